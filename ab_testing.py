@@ -0,0 +1,351 @@
+"""
+Sequential A/B tests for rule, deck and agent changes. Baseline and candidate play paired games with the same seeds,
+so both arms get the same shuffles as long as they play with the same deck. Rule changes are compared by giving the
+candidate its own engine (see `simulation.Engine`). After every pair, a sequential probability ratio test (SPRT)
+decides whether the candidate changed the win rate or the mean game length in turns, or whether any change is smaller
+than the minimum effect of interest. Clear differences are usually detected after a fraction of
+the games a fixed-size test with the same error rates needs.
+
+Usage:
+    python ab_testing.py --candidate-deck my_deck.txt --players 3 --seat 0
+    python ab_testing.py --candidate-params 6 1 8 0 1 0 --players 3 --jobs 8
+    python ab_testing.py --candidate-engine my_rules:create_game --turns-delta 0.5
+"""
+import argparse
+import math
+import multiprocessing
+import statistics
+import time
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Iterator, NamedTuple
+
+from agent import Agent
+from heuristic_agent import HeuristicAgent
+from simulation import (AgentFactory, Engine, heuristic_agents, play_game, random_agents, reference_engine,
+                        resolve_engine)
+
+
+def focus_seat(seed: int, num_players: int, seat: int | None = None) -> int:
+    """ :return: Seat whose win rate is compared, which rotates with the seed if no fixed `seat` is given. """
+    return seat if seat is not None else seed % num_players
+
+
+@dataclass(frozen=True)
+class ParamAgents:
+    """ `AgentFactory` for heuristic agents with the given parameter vector, see `HeuristicParams`. """
+    params: tuple[float, ...]
+
+    def __call__(self, seed: int, seat: int) -> Agent:
+        return HeuristicAgent(self.params, seed=seed * 16 + seat)
+
+
+@dataclass(frozen=True)
+class FocusSeatAgents:
+    """
+    `AgentFactory` which lets `focus` play the focus seat (see `focus_seat`) and `opponents` all other seats.
+    Used to compare agents against the same opponents.
+    """
+    focus: AgentFactory
+    num_players: int
+    opponents: AgentFactory = heuristic_agents
+    seat: int | None = None
+
+    def __call__(self, seed: int, seat: int) -> Agent:
+        if seat == focus_seat(seed, self.num_players, self.seat):
+            return self.focus(seed, seat)
+        return self.opponents(seed, seat)
+
+
+@dataclass
+class Arm:
+    """ Rules and agents of one side of an A/B test. """
+    name: str
+    deck: str | dict[str, int] = "deck.txt"
+    agent_factory: AgentFactory = heuristic_agents
+    # Must be picklable, i.e. a module-level function, to play with several processes
+    engine: Engine = reference_engine
+
+
+class PairOutcome(NamedTuple):
+    """ Outcome of both games of a seed: whether the focus seat won and the number of turns, per arm. """
+    seed: int
+    baseline_won: int
+    candidate_won: int
+    baseline_turns: int
+    candidate_turns: int
+
+
+def play_pairs(seeds: range, num_players: int, baseline: Arm, candidate: Arm, seat: int | None) -> list[PairOutcome]:
+    """ Plays the games of both arms for every seed. """
+    outcomes = []
+    for seed in seeds:
+        results = []
+        for arm in (baseline, candidate):
+            game = play_game(seed, num_players, arm.deck, arm.agent_factory, arm.engine)
+            won = int(game.winner is game.players[focus_seat(seed, num_players, seat)])
+            turns = sum(event.turn_number for event in game.events if event.kind == "round_end")
+            results.append((won, turns))
+        outcomes.append(PairOutcome(seed, results[0][0], results[1][0], results[0][1], results[1][1]))
+    return outcomes
+
+
+class MeanSPRT:
+    """
+    Two-sided generalized SPRT on paired differences. Tests whether their mean is 0, against a mean of `delta` and
+    `-delta`, using the normal approximation with the observed variance of the differences.
+    Each one-sided test runs at `alpha / 2`, "no difference" is accepted once both reject their alternative.
+    """
+
+    def __init__(self, delta: float, alpha: float = 0.05, beta: float = 0.1):
+        """
+        :param delta: Minimum effect of interest, as mean of the paired differences.
+        :param alpha: Probability of detecting a difference that doesn't exist.
+        :param beta: Probability of missing a difference of at least `delta`.
+        """
+        if delta <= 0:
+            raise ValueError("delta must be positive")
+        self.delta = delta
+        self.alpha = alpha
+        self.beta = beta
+        self.pairs = 0
+        self.positives = 0
+        self.negatives = 0
+        self.total = 0.0
+        self.sum_squares = 0.0
+        self.upper = math.log((1 - beta) / (alpha / 2))
+        self.lower = math.log(beta / (1 - alpha / 2))
+
+    def value(self, difference: float) -> float:
+        """ :return: Value of a paired difference whose mean is tested. """
+        return difference
+
+    @property
+    def unit(self) -> float:
+        """ Size of the pseudo-pair in the variance. """
+        return self.delta
+
+    def add(self, difference: float) -> None:
+        value = self.value(difference)
+        self.pairs += 1
+        self.total += value
+        self.sum_squares += value * value
+        if value > 0:
+            self.positives += 1
+        elif value < 0:
+            self.negatives += 1
+
+    @property
+    def variance(self) -> float:
+        """ Variance of the values, with one pseudo-pair of size `unit`, so it is never 0. """
+        n = self.pairs + 1
+        mean = self.total / n
+        return (self.sum_squares + self.unit * self.unit) / n - mean * mean
+
+    @property
+    def log_likelihood_ratios(self) -> tuple[float, float]:
+        """ :return: Log-likelihood ratios of a mean of `delta` and of `-delta` against a mean of 0. """
+        scale = self.delta / self.variance
+        return (scale * (self.total - self.pairs * self.delta / 2),
+                scale * (-self.total - self.pairs * self.delta / 2))
+
+    @property
+    def decision(self) -> str | None:
+        """ :return: "+" or "-" for the sign of a detected difference, "=" for no difference, None if undecided. """
+        increase, decrease = self.log_likelihood_ratios
+        if increase >= self.upper:
+            return "+"
+        if decrease >= self.upper:
+            return "-"
+        if increase <= self.lower and decrease <= self.lower:
+            return "="
+        return None
+
+    def fixed_sample_size(self) -> int:
+        """ :return: Number of pairs a fixed-size test with the same error rates needs at the observed variance. """
+        normal = statistics.NormalDist()
+        return math.ceil(self.variance * ((normal.inv_cdf(1 - self.alpha / 2) + normal.inv_cdf(1 - self.beta))
+                                          / self.delta) ** 2)
+
+
+class SignSPRT(MeanSPRT):
+    """
+    `MeanSPRT` on the signs (-1, 0 or 1) of paired differences. For win rates, the mean sign is exactly the difference
+    of the win rates. Ties count as evidence against a difference, so arms which rarely differ at all stop quickly.
+    """
+
+    def __init__(self, delta: float = 0.05, alpha: float = 0.05, beta: float = 0.1):
+        """ See `MeanSPRT`, `delta` is the minimum mean sign of interest. """
+        if not 0 < delta < 1:
+            raise ValueError("delta must be between 0 and 1")
+        super().__init__(delta, alpha, beta)
+
+    def value(self, difference: float) -> float:
+        return float((difference > 0) - (difference < 0))
+
+    @property
+    def unit(self) -> float:
+        # A discordant pair
+        return 1.0
+
+
+@dataclass
+class MetricResult:
+    name: str
+    baseline_mean: float
+    candidate_mean: float
+    # Confidence interval of the mean paired difference (candidate - baseline)
+    ci_low: float
+    ci_high: float
+    positives: int
+    negatives: int
+    decision: str | None
+    fixed_sample_size: int
+
+
+@dataclass
+class ABResult:
+    games: int
+    max_games: int
+    stopped_by: str | None
+    metrics: list[MetricResult] = field(default_factory=list)
+
+
+def _confidence_interval(differences: list[float], alpha: float) -> tuple[float, float]:
+    mean = statistics.fmean(differences)
+    if len(differences) < 2:
+        return -math.inf, math.inf
+    half_width = (statistics.NormalDist().inv_cdf(1 - alpha / 2) * statistics.stdev(differences)
+                  / math.sqrt(len(differences)))
+    return mean - half_width, mean + half_width
+
+
+def _outcomes(seeds: range, num_players: int, baseline: Arm, candidate: Arm, seat: int | None, jobs: int,
+              chunk_size: int) -> Iterator[PairOutcome]:
+    """ Yields the outcomes in seed order, no matter how many processes play the games. """
+    chunks = [seeds[start:start + chunk_size] for start in range(0, len(seeds), chunk_size)]
+    play = partial(play_pairs, num_players=num_players, baseline=baseline, candidate=candidate, seat=seat)
+    if jobs <= 1:
+        for chunk in chunks:
+            yield from play(chunk)
+        return
+    # Leaving the `with` block terminates the pool, so remaining chunks aren't played once the test stopped
+    with multiprocessing.Pool(jobs) as pool:
+        for outcomes in pool.imap(play, chunks):
+            yield from outcomes
+
+
+def ab_test(baseline: Arm, candidate: Arm, num_players: int = 3, seat: int | None = None, delta: float = 0.05,
+            alpha: float = 0.05, beta: float = 0.1, max_games: int = 20000, start_seed: int = 0, jobs: int = 1,
+            chunk_size: int = 50, turns_delta: float = 1.0) -> ABResult:
+    """
+    Plays paired games until the win rate of the focus seat or the game length differs between both arms,
+    both metrics are found to be equal, or `max_games` pairs have been played.
+
+    :param baseline: Arm to compare against.
+    :param candidate: Arm with the change.
+    :param num_players: Number of players.
+    :param seat: Seat whose win rate is compared. By default, the seat rotates with the seed.
+    :param delta: Minimum difference of win rates of interest, see `SignSPRT`.
+    :param alpha: False positive rate per metric.
+    :param beta: False negative rate per metric.
+    :param max_games: Maximum number of pairs of games.
+    :param start_seed: First seed.
+    :param jobs: Number of processes.
+    :param chunk_size: Number of pairs per task of a process.
+    :param turns_delta: Minimum difference of the mean number of turns per game of interest, see `MeanSPRT`.
+    :return: Result of the test. Confidence intervals aren't corrected for early stopping, so they are slightly
+        too narrow.
+    """
+    tests = {"win rate": SignSPRT(delta, alpha, beta), "turns": MeanSPRT(turns_delta, alpha, beta)}
+    values: dict[str, tuple[list[int], list[int]]] = {name: ([], []) for name in tests}
+    stopped_by = None
+    games = 0
+    for outcome in _outcomes(range(start_seed, start_seed + max_games), num_players, baseline, candidate, seat,
+                             jobs, chunk_size):
+        _, baseline_won, candidate_won, baseline_turns, candidate_turns = outcome
+        games += 1
+        for name, (baseline_value, candidate_value) in (("win rate", (baseline_won, candidate_won)),
+                                                         ("turns", (baseline_turns, candidate_turns))):
+            values[name][0].append(baseline_value)
+            values[name][1].append(candidate_value)
+            tests[name].add(candidate_value - baseline_value)
+        decisions = {name: test.decision for name, test in tests.items()}
+        stopped_by = next((name for name, decision in decisions.items() if decision in ("+", "-")), None)
+        if stopped_by is not None:
+            break
+        if all(decision == "=" for decision in decisions.values()):
+            stopped_by = "all"
+            break
+
+    result = ABResult(games, max_games, stopped_by)
+    for name, test in tests.items():
+        baseline_values, candidate_values = values[name]
+        ci_low, ci_high = _confidence_interval([b - a for a, b in zip(baseline_values, candidate_values)], alpha)
+        result.metrics.append(MetricResult(name, statistics.fmean(baseline_values), statistics.fmean(candidate_values),
+                                           ci_low, ci_high, test.positives, test.negatives, test.decision,
+                                           test.fixed_sample_size()))
+    return result
+
+
+def print_report(result: ABResult, baseline: Arm, candidate: Arm, confidence: float) -> None:
+    verdicts = {"+": "candidate is higher", "-": "candidate is lower", "=": "no relevant difference",
+                None: "undecided"}
+    print(f"{baseline.name} vs {candidate.name}: {result.games} paired games "
+          f"({'stopped early' if result.stopped_by is not None else f'reached the limit of {result.max_games}'})")
+    for metric in result.metrics:
+        print(f"  {metric.name:>8}: {metric.baseline_mean:.3f} -> {metric.candidate_mean:.3f}, "
+              f"difference {metric.candidate_mean - metric.baseline_mean:+.3f} "
+              f"({confidence:.0%} CI {metric.ci_low:+.3f} .. {metric.ci_high:+.3f}), "
+              f"{metric.positives}+/{metric.negatives}- pairs: {verdicts[metric.decision]} "
+              f"(a fixed-size test needs {metric.fixed_sample_size} games)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sequential A/B test of decks or agents with paired games")
+    parser.add_argument("--players", type=int, default=3, help="Number of players")
+    parser.add_argument("--seat", type=int, default=None, help="Seat whose win rate is compared (default: rotating)")
+    parser.add_argument("--baseline-deck", default="deck.txt", help="Deck file of the baseline")
+    parser.add_argument("--candidate-deck", default="deck.txt", help="Deck file of the candidate")
+    for arm in ("baseline", "candidate"):
+        parser.add_argument(f"--{arm}-engine", default="reference",
+                            help=f"Engine of the {arm} games, reference or module:callable, see simulation.Engine")
+        parser.add_argument(f"--{arm}-agent", choices=["heuristic", "random"], default="heuristic",
+                            help=f"Agent of the focus seat in the {arm} games")
+        parser.add_argument(f"--{arm}-params", type=float, nargs="+", default=None,
+                            help=f"Parameter vector of the heuristic agent of the focus seat in the {arm} games")
+    parser.add_argument("--delta", type=float, default=0.05,
+                        help="Minimum difference of win rates of interest")
+    parser.add_argument("--turns-delta", type=float, default=1.0,
+                        help="Minimum difference of the mean number of turns per game of interest")
+    parser.add_argument("--alpha", type=float, default=0.05, help="False positive rate")
+    parser.add_argument("--beta", type=float, default=0.1, help="False negative rate")
+    parser.add_argument("--max-games", type=int, default=20000, help="Maximum number of paired games")
+    parser.add_argument("--start-seed", type=int, default=0, help="First seed")
+    parser.add_argument("--jobs", type=int, default=1, help="Number of processes")
+    arguments = parser.parse_args()
+
+    arms = []
+    for arm in ("baseline", "candidate"):
+        deck = getattr(arguments, f"{arm}_deck")
+        params = getattr(arguments, f"{arm}_params")
+        agent = getattr(arguments, f"{arm}_agent")
+        engine = getattr(arguments, f"{arm}_engine")
+        if params is not None:
+            focus = ParamAgents(tuple(params))
+        else:
+            focus = random_agents if agent == "random" else heuristic_agents
+        name = f"{arm} ({deck}, {agent if params is None else params}, {engine})"
+        arms.append(Arm(name, deck, FocusSeatAgents(focus, arguments.players, seat=arguments.seat),
+                        resolve_engine(engine)))
+
+    started = time.perf_counter()
+    result = ab_test(arms[0], arms[1], arguments.players, arguments.seat, arguments.delta, arguments.alpha,
+                     arguments.beta, arguments.max_games, arguments.start_seed, arguments.jobs,
+                     turns_delta=arguments.turns_delta)
+    print_report(result, arms[0], arms[1], 1 - arguments.alpha)
+    print(f"Took {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+import random
+from abc import ABC, abstractmethod
+
+from card import Card
+from effect import Effect
+from player import Player
+
+
+class Agent(ABC):
+    """
+    Base class for CPU players. An agent is asked for every decision its player has to make, instead of prompting
+    the user via `input()`. Agents are assigned to players when creating the `Gamestate`.
+
+    All options passed to an agent are valid choices, so an agent never has to check activation conditions or
+    target filters itself. Subclasses must implement all decisions, otherwise they can't be instantiated.
+    """
+
+    @abstractmethod
+    def select_effect(self, gamestate: "Gamestate", player: Player, effects: list[Effect]) -> Effect:
+        """
+        Selects one of the available effects, e.g. to decide which card to play.
+
+        :param gamestate: Current gamestate.
+        :param player: Player who activates the effect.
+        :param effects: Effects that can be activated. Never empty.
+        :return: Selected effect.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def select_target(self, gamestate: "Gamestate", player: Player, targets: list[Player]) -> Player:
+        """
+        Selects a target player for an effect.
+
+        :param gamestate: Current gamestate.
+        :param player: Player who is asked to select a target.
+        :param targets: Valid targets. Never empty.
+        :return: Selected player.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def select_card(self, gamestate: "Gamestate", player: Player, cards: list[Card]) -> Card:
+        """
+        Selects a card from a list of cards without playing it, e.g. to hand it to another player.
+
+        :param gamestate: Current gamestate.
+        :param player: Player who is asked to select a card.
+        :param cards: Cards to choose from. Contains at least two cards.
+        :return: Selected card.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def select_value(self, gamestate: "Gamestate", player: Player, start: int, end: int) -> int:
+        """
+        Selects a card value between `start` and `end` (both inclusive), e.g. to guess a hand card.
+
+        :param gamestate: Current gamestate.
+        :param player: Player who is asked to select a value.
+        :param start: Minimum value.
+        :param end: Maximum value.
+        :return: Selected value.
+        """
+        raise NotImplementedError
+
+
+class RandomAgent(Agent):
+    """ Agent that picks uniformly among all valid options. """
+
+    def __init__(self, seed: int | None = None):
+        self.rng = random.Random(seed)
+
+    def select_effect(self, gamestate: "Gamestate", player: Player, effects: list[Effect]) -> Effect:
+        return self.rng.choice(effects)
+
+    def select_target(self, gamestate: "Gamestate", player: Player, targets: list[Player]) -> Player:
+        return self.rng.choice(targets)
+
+    def select_card(self, gamestate: "Gamestate", player: Player, cards: list[Card]) -> Card:
+        return self.rng.choice(cards)
+
+    def select_value(self, gamestate: "Gamestate", player: Player, start: int, end: int) -> int:
+        return self.rng.randint(start, end)
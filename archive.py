@@ -0,0 +1,296 @@
+import json
+import sqlite3
+from dataclasses import dataclass, field
+from typing import Iterable, Iterator, NamedTuple
+
+from gamestate import Gamestate
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    game_id     INTEGER PRIMARY KEY,
+    source      TEXT NOT NULL,
+    seed        INTEGER,
+    players     TEXT NOT NULL,
+    winner      TEXT,
+    win_type    TEXT,
+    rounds      INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS rounds (
+    game_id     INTEGER NOT NULL,
+    round_no    INTEGER NOT NULL,
+    winner      TEXT,
+    win_type    TEXT,
+    turns       INTEGER NOT NULL,
+    events      TEXT NOT NULL,
+    PRIMARY KEY (game_id, round_no)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS round_cards (
+    card_code   TEXT NOT NULL,
+    game_id     INTEGER NOT NULL,
+    round_no    INTEGER NOT NULL,
+    PRIMARY KEY (card_code, game_id, round_no)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS round_mad (
+    player      TEXT NOT NULL,
+    round_no    INTEGER NOT NULL,
+    game_id     INTEGER NOT NULL,
+    PRIMARY KEY (player, round_no, game_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS games_winner ON games (winner);
+CREATE INDEX IF NOT EXISTS games_win_type ON games (win_type);
+CREATE INDEX IF NOT EXISTS rounds_winner ON rounds (winner);
+CREATE INDEX IF NOT EXISTS rounds_win_type ON rounds (win_type);
+"""
+
+# Draw events make up the bulk of a game's event log, but can be reconstructed from the deck order and are not needed
+# for any analysis so far. Only these kinds are stored with a round.
+ARCHIVED_EVENT_KINDS = frozenset({"play", "discard", "eliminate"})
+
+
+class ArchivedEvent(NamedTuple):
+    game_id: int
+    round_no: int
+    turn_no: int
+    kind: str
+    player: str | None
+    card_code: str | None
+    target: str | None
+    detail: str | None
+
+
+@dataclass
+class GameRecord:
+    """
+    Rows describing one finished game, ready to be inserted into a `GameArchive`.
+    The `game_id` is assigned by the archive when the record is written, so rows don't contain it yet.
+
+    Events of a round are packed into a single string (see `GameRecord.pack_event`), since one row per event is too
+    slow to insert. The cards played in a round and the players who went mad are stored in separate tables, which
+    are clustered by card code and player name respectively, so those can still be looked up without a scan.
+    """
+    source: str
+    seed: int | None
+    players: list[str]
+    winner: str | None
+    win_type: str | None
+    rounds: list[tuple] = field(default_factory=list)
+    round_cards: list[tuple] = field(default_factory=list)
+    round_mad: list[tuple] = field(default_factory=list)
+
+    @classmethod
+    def from_gamestate(cls, gamestate: Gamestate, source: str = "production", seed: int | None = None
+                       ) -> "GameRecord":
+        """
+        Builds the archive rows for a game from the event log of `gamestate`.
+
+        :param gamestate: Gamestate of a game that was played (completely or partially).
+        :param source: Label describing where the game comes from, e.g. "production" or "simulation".
+        :param seed: Seed the game was played with, if any.
+        :return: Record of the game.
+        """
+        names = [player.name for player in gamestate.players]
+        record = cls(source=source, seed=seed, players=names,
+                     winner=gamestate.winner.name if gamestate.winner is not None else None,
+                     win_type=None)
+        packed_events, cards_played = [], set()
+        for event in gamestate.events:
+            if event.kind in ARCHIVED_EVENT_KINDS:
+                packed_events.append(cls.pack_event(event.turn_number, event.kind, event.player, event.card,
+                                                    event.target, event.detail))
+                if event.kind == "play":
+                    cards_played.add(event.card)
+            elif event.kind == "mad":
+                record.round_mad.append((names[event.player], event.round_number))
+            elif event.kind == "round_end":
+                winner = names[event.player] if event.player >= 0 else None
+                record.rounds.append((event.round_number, winner, event.detail or None, event.turn_number,
+                                      "|".join(packed_events)))
+                record.round_cards.extend((card, event.round_number) for card in cards_played)
+                packed_events, cards_played = [], set()
+            elif event.kind == "game_end":
+                record.win_type = event.detail or None
+        return record
+
+    @staticmethod
+    def pack_event(turn_number: int, kind: str, player: int, card: str, target: int, detail: str) -> str:
+        """ Packs an event of a round into a compact string. Players are referenced by their seat index. """
+        return f"{turn_number},{kind[0]},{player},{card},{target},{detail}"
+
+    @staticmethod
+    def unpack_events(game_id: int, round_no: int, players: list[str], packed: str) -> Iterator[ArchivedEvent]:
+        """ Reverses `pack_event` for all events of a round. """
+        kinds = {kind[0]: kind for kind in ARCHIVED_EVENT_KINDS}
+        for packed_event in packed.split("|") if packed else ():
+            turn_number, kind, player, card, target, detail = packed_event.split(",")
+            yield ArchivedEvent(game_id, round_no, int(turn_number), kinds[kind],
+                                players[int(player)] if player != "-1" else None, card or None,
+                                players[int(target)] if target != "-1" else None, detail or None)
+
+
+class GameArchive:
+    """
+    Local SQLite store for finished games, their rounds and compact per-turn events.
+
+    The database runs in WAL mode, so any number of processes can read while others write. Every process should use
+    its own `GameArchive` instance. Games are buffered and written in batches, each batch in a single transaction.
+    """
+
+    def __init__(self, path: str = "games.sqlite", batch_size: int = 1000, timeout: float = 60.0):
+        """
+        :param path: Path of the SQLite database file. It is created if it doesn't exist.
+        :param batch_size: Number of buffered games that triggers a write to the database.
+        :param timeout: Seconds to wait for other writers to release their lock.
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self._pending: list[GameRecord] = []
+        self.connection = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        # WAL mode stays consistent with `synchronous=NORMAL`, only the most recent commits may be lost on power loss
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("PRAGMA cache_size=-65536")
+        self.connection.executescript(SCHEMA)
+
+    def __enter__(self) -> "GameArchive":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    def add(self, record: GameRecord | Gamestate) -> None:
+        """
+        Buffers a game for writing. The buffer is flushed automatically once it holds `batch_size` games.
+
+        :param record: Record of the game or the `Gamestate` it was played in.
+        """
+        if isinstance(record, Gamestate):
+            record = GameRecord.from_gamestate(record)
+        self._pending.append(record)
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def add_many(self, records: Iterable[GameRecord | Gamestate]) -> None:
+        """ Buffers several games for writing, see `add`. """
+        for record in records:
+            self.add(record)
+
+    def flush(self) -> None:
+        """
+        Writes all buffered games in a single transaction.
+        Game ids are allocated while holding the write lock, so concurrent writers never hand out the same id.
+        """
+        if len(self._pending) == 0:
+            return
+        records, self._pending = self._pending, []
+        cursor = self.connection.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            first_id = cursor.execute("SELECT COALESCE(MAX(game_id), 0) + 1 FROM games").fetchone()[0]
+            games, rounds, round_cards, round_mad = [], [], [], []
+            for game_id, record in enumerate(records, start=first_id):
+                games.append((game_id, record.source, record.seed, json.dumps(record.players), record.winner,
+                              record.win_type, len(record.rounds)))
+                rounds.extend((game_id, *row) for row in record.rounds)
+                round_cards.extend((card, game_id, round_no) for card, round_no in record.round_cards)
+                round_mad.extend((player, round_no, game_id) for player, round_no in record.round_mad)
+            cursor.executemany("INSERT INTO games VALUES (?, ?, ?, ?, ?, ?, ?)", games)
+            cursor.executemany("INSERT INTO rounds VALUES (?, ?, ?, ?, ?, ?)", rounds)
+            cursor.executemany("INSERT INTO round_cards VALUES (?, ?, ?)", round_cards)
+            cursor.executemany("INSERT INTO round_mad VALUES (?, ?, ?)", round_mad)
+            cursor.execute("COMMIT")
+        except BaseException:
+            cursor.execute("ROLLBACK")
+            self._pending = records + self._pending
+            raise
+
+    def close(self) -> None:
+        """ Writes all buffered games and closes the database connection. """
+        self.flush()
+        self.connection.close()
+
+    def query(self, sql: str, parameters: tuple | dict = (), chunk_size: int = 1000) -> Iterator[sqlite3.Row]:
+        """
+        Runs an arbitrary read query and lazily yields the resulting rows, fetching `chunk_size` rows at a time.
+        Buffered games are not visible until they were flushed.
+        """
+        cursor = self.connection.execute(sql, parameters)
+        try:
+            while rows := cursor.fetchmany(chunk_size):
+                yield from rows
+        finally:
+            cursor.close()
+
+    def iter_games(self, winner: str | None = None, win_type: str | None = None, source: str | None = None,
+                   mad_player: str | None = None, mad_in_round: int | None = None) -> Iterator[sqlite3.Row]:
+        """
+        Lazily yields all games matching the given filters. Filters that are `None` are ignored.
+
+        :param winner: Name of the player who won the game.
+        :param win_type: How the game was won, e.g. "sanity_score", "madness_score" or "card8_madness_effect".
+        :param source: Source label the game was archived with.
+        :param mad_player: Only games where this player went mad (in `mad_in_round`, if given).
+        :param mad_in_round: Round number to check for `mad_player`. Ignored without `mad_player`.
+        """
+        conditions, parameters = self._conditions(winner=winner, win_type=win_type, source=source)
+        if mad_player is not None:
+            subquery = "SELECT game_id FROM round_mad WHERE player = ?"
+            parameters.append(mad_player)
+            if mad_in_round is not None:
+                subquery += " AND round_no = ?"
+                parameters.append(mad_in_round)
+            conditions.append(f"game_id IN ({subquery})")
+        yield from self.query(f"SELECT * FROM games {self._where(conditions)} ORDER BY game_id", tuple(parameters))
+
+    def iter_rounds(self, winner: str | None = None, win_type: str | None = None, game_id: int | None = None,
+                    card_code: str | None = None) -> Iterator[sqlite3.Row]:
+        """
+        Lazily yields all rounds matching the given filters. Filters that are `None` are ignored.
+
+        :param winner: Name of the player who won the round.
+        :param win_type: Why the round ended, e.g. "last_survivor", "deck_out" or "card7_madness_effect".
+        :param game_id: Only rounds of this game.
+        :param card_code: Only rounds in which a card with this code was played, e.g. "7m".
+        """
+        conditions, parameters = self._conditions(winner=winner, win_type=win_type, game_id=game_id)
+        if card_code is not None:
+            conditions.append("(game_id, round_no) IN (SELECT game_id, round_no FROM round_cards WHERE card_code = ?)")
+            parameters.append(card_code)
+        yield from self.query(f"SELECT * FROM rounds {self._where(conditions)} ORDER BY game_id, round_no",
+                              tuple(parameters))
+
+    def iter_events(self, card_code: str | None = None, kind: str | None = None, detail: str | None = None,
+                    game_id: int | None = None) -> Iterator[ArchivedEvent]:
+        """
+        Lazily yields all archived events matching the given filters. Filters that are `None` are ignored.
+        If `card_code` is given with `kind="play"`, only rounds in which that card was played are unpacked.
+
+        :param card_code: Code of the card involved, e.g. "7m".
+        :param kind: Kind of event, see `ARCHIVED_EVENT_KINDS`.
+        :param detail: Detail of the event, e.g. the effect function of a "play" event.
+        :param game_id: Only events of this game.
+        """
+        # Cards that are only discarded or eliminated with aren't listed in `round_cards`, so don't narrow down rounds
+        round_card_code = card_code if kind == "play" else None
+        game_players = None, []
+        for round_row in self.iter_rounds(game_id=game_id, card_code=round_card_code):
+            if game_players[0] != round_row["game_id"]:
+                players_json = self.connection.execute("SELECT players FROM games WHERE game_id = ?",
+                                                       (round_row["game_id"],)).fetchone()["players"]
+                game_players = round_row["game_id"], json.loads(players_json)
+            for event in GameRecord.unpack_events(round_row["game_id"], round_row["round_no"], game_players[1],
+                                                  round_row["events"]):
+                if ((card_code is None or event.card_code == card_code) and
+                        (kind is None or event.kind == kind) and
+                        (detail is None or event.detail == detail)):
+                    yield event
+
+    @staticmethod
+    def _conditions(**filters) -> tuple[list[str], list]:
+        conditions = [f"{column} = ?" for column, value in filters.items() if value is not None]
+        parameters = [value for value in filters.values() if value is not None]
+        return conditions, parameters
+
+    @staticmethod
+    def _where(conditions: list[str]) -> str:
+        return f"WHERE {' AND '.join(conditions)}" if len(conditions) > 0 else ""
@@ -23,9 +23,11 @@ CARD_NAMES = {
     "8": "Necronomicon",
     "8m": "Cthulhu",
 }
+# Cylinders are created by `card5_madness_effect` and don't come from the deck, so they are ignored for conservation
+CREATED_CARD_CODES = frozenset({"0m"})
 
 
-@dataclass
+@dataclass(slots=True)
 class Card:
     code: str
     name: str = field(init=False)
@@ -43,12 +45,23 @@ class Card:
         self.effect_on_discard = discard_effect if discard_effect.effect is not None else None
 
     def __eq__(self, other):
-        return self.code == other.code
+        return self is other or self.code == other.code
 
     def __str__(self):
         return (f"{Fore.GREEN if self.effect_madness is not None else Fore.RESET}"
                 f"[{self.value}] {self.name}{Fore.RESET}")
 
+    @staticmethod
+    def by_code(code: str) -> "Card":
+        """
+        Returns the shared instance of the card with the given code. Cards are never modified during a game, so all
+        copies of a card in all games can be the same instance, which saves creating the card and its effects.
+        """
+        card = SHARED_CARDS.get(code)
+        if card is None:
+            card = SHARED_CARDS[code] = Card(code)
+        return card
+
     @staticmethod
     def name_by_code(code: str) -> str:
         return CARD_NAMES.get(code, "Unknown")
@@ -71,3 +84,6 @@ class Card:
         """
         return ((self.effect.can_activate(gamestate, player)) or (
                 self.effect_madness is not None and self.effect_madness.can_activate(gamestate, player)))
+
+
+SHARED_CARDS: dict[str, Card] = {}
@@ -0,0 +1,231 @@
+"""
+Compact representation of a running game. A `CompactState` stores the same information as the round state of a
+`Gamestate`, but cards are small integers in byte strings and player flags are bitmasks over the player indices.
+
+Servers keep one `CompactState` per idle table instead of a whole `Gamestate`, and bots snapshot a state before
+playing ahead and restore it afterwards. `Gamestate` stays the API all rules are written against, it is only
+materialized from a `CompactState` when a table is actually played.
+
+Usage:
+    snapshot = CompactState.from_gamestate(game)
+    ...  # play ahead
+    snapshot.restore(game)
+"""
+import sys
+import time
+import tracemalloc
+from array import array
+from collections import defaultdict
+from functools import partial
+
+from card import Card, CARD_NAMES
+from gamestate import Gamestate
+from player import Player
+
+# Card codes by card id and card ids by card code. Ids are stable as long as `CARD_NAMES` isn't reordered.
+CARD_CODES: tuple[str, ...] = tuple(CARD_NAMES)
+CARD_IDS: dict[str, int] = {code: i for i, code in enumerate(CARD_CODES)}
+MADNESS_CARD_IDS = frozenset(i for i, code in enumerate(CARD_CODES) if code.endswith("m"))
+
+
+def encode_cards(cards: list[Card]) -> bytes:
+    return bytes([CARD_IDS[card.code] for card in cards])
+
+
+def decode_cards(card_ids: bytes) -> list[Card]:
+    return [Card.by_code(CARD_CODES[card_id]) for card_id in card_ids]
+
+
+def _bitmask(players: list[Player], subset: set[Player]) -> int:
+    mask = 0
+    for i, player in enumerate(players):
+        if player in subset:
+            mask |= 1 << i
+    return mask
+
+
+def _players_in(players: list[Player], mask: int) -> set[Player]:
+    return {player for i, player in enumerate(players) if mask >> i & 1}
+
+
+def _is_unprotect_hook(hook, player: Player) -> bool:
+    return (isinstance(hook, partial) and hook.func is Gamestate.unprotect_player
+            and hook.args == () and hook.keywords == {"player": player})
+
+
+class CompactState:
+    """
+    Immutable snapshot of a round in progress. Everything that isn't needed to continue the game is left out,
+    i.e. the event log, the agents and `after_turn_hooks`. Players and the deck composition are shared with the
+    gamestate the snapshot was taken from, since neither is modified during a game.
+    """
+    __slots__ = ("players", "deck_composition", "deck", "banished", "hands", "discards", "out", "protected",
+                 "unprotect", "turn_player", "round_number", "turn_number", "scores", "rng_state")
+
+    players: tuple[Player, ...]
+    deck_composition: dict[str, int]
+    # Card ids of the deck, banished cards, and hand and discard pile per player index
+    deck: bytes
+    banished: bytes
+    hands: tuple[bytes, ...]
+    discards: tuple[bytes, ...]
+    # Bitmasks over player indices: players out of the round, protected players and players whose protection ends
+    # at the start of their next turn
+    out: int
+    protected: int
+    unprotect: int
+    turn_player: int
+    round_number: int
+    turn_number: int
+    # Sanity and madness score per player index, interleaved
+    scores: bytes
+    # Internal state of the Mersenne Twister without version and gauss_next, see `random.Random.getstate()`
+    rng_state: bytes
+
+    @property
+    def mad(self) -> int:
+        """ Bitmask of all players who have at least one madness card in their discard pile. """
+        return _bitmask(list(self.players), {player for player, discard_pile in zip(self.players, self.discards)
+                                             if not MADNESS_CARD_IDS.isdisjoint(discard_pile)})
+
+    @classmethod
+    def from_gamestate(cls, gamestate: Gamestate) -> "CompactState":
+        """
+        Takes a snapshot of a gamestate. The round must have been initialized already.
+
+        :param gamestate: Gamestate to take the snapshot of.
+        :return: Snapshot of the gamestate.
+        :raises ValueError: If a turn start hook is scheduled which can't be represented, i.e. any hook other than
+            the end of a protection.
+        """
+        if not hasattr(gamestate, "deck"):
+            raise ValueError("Round hasn't been initialized yet")
+        players = gamestate.players
+        unprotect = set()
+        for player, hooks in gamestate.on_player_turn_start.items():
+            for hook in hooks:
+                if not _is_unprotect_hook(hook, player):
+                    raise ValueError(f"Turn start hook {hook!r} of {player.name} can't be stored compactly")
+                unprotect.add(player)
+        version, mt_state, gauss_next = gamestate.rng.getstate()
+        if version != 3 or gauss_next is not None:
+            raise ValueError("Unsupported random number generator state")
+
+        state = object.__new__(cls)
+        state.players = tuple(players)
+        state.deck_composition = gamestate.deck_composition
+        state.deck = encode_cards(gamestate.deck)
+        state.banished = encode_cards(gamestate.banished_cards)
+        state.hands = tuple(encode_cards(gamestate.hands[player]) for player in players)
+        state.discards = tuple(encode_cards(gamestate.discard_pile[player]) for player in players)
+        state.out = _bitmask(players, gamestate.players_out)
+        state.protected = _bitmask(players, gamestate.players_protected)
+        state.unprotect = _bitmask(players, unprotect)
+        state.turn_player = players.index(gamestate.turn_player)
+        state.round_number = gamestate.round_number
+        state.turn_number = gamestate.turn_number
+        state.scores = array("H", [score for player in players for score in gamestate.scores[player]]).tobytes()
+        state.rng_state = array("I", mt_state).tobytes()
+        return state
+
+    def restore(self, gamestate: Gamestate) -> None:
+        """
+        Resets a gamestate of the same game to this snapshot in place. Agents, hooks and the event log of the
+        gamestate are kept.
+
+        :param gamestate: Gamestate to reset. Must have the same players as the snapshot.
+        """
+        if tuple(gamestate.players) != self.players:
+            raise ValueError("Gamestate has different players than the snapshot")
+        players = self.players
+        gamestate.deck_composition = self.deck_composition
+        gamestate.deck = decode_cards(self.deck)
+        gamestate.banished_cards = decode_cards(self.banished)
+        gamestate.hands = {player: decode_cards(hand) for player, hand in zip(players, self.hands)}
+        gamestate.discard_pile = {player: decode_cards(discard_pile)
+                                  for player, discard_pile in zip(players, self.discards)}
+        gamestate.players_out = _players_in(gamestate.players, self.out)
+        gamestate.players_protected = _players_in(gamestate.players, self.protected)
+        gamestate.on_player_turn_start = defaultdict(list)
+        for player in _players_in(gamestate.players, self.unprotect):
+            gamestate.schedule_on_player_turn_start(player, partial(Gamestate.unprotect_player, player=player))
+        gamestate.turn_player = players[self.turn_player]
+        gamestate.round_number = self.round_number
+        gamestate.turn_number = self.turn_number
+        scores = array("H")
+        scores.frombytes(self.scores)
+        gamestate.scores = {player: (scores[2 * i], scores[2 * i + 1]) for i, player in enumerate(players)}
+        gamestate.rng.setstate((3, tuple(array("I", self.rng_state)), None))
+
+    def to_gamestate(self, agents: list | None = None, headless: bool = True) -> Gamestate:
+        """
+        Creates a new gamestate from this snapshot, which continues the game at the start of the snapshot's turn.
+
+        :param agents: Agents of the players, see `Gamestate`.
+        :param headless: See `Gamestate`.
+        :return: New gamestate.
+        """
+        gamestate = Gamestate([player.name for player in self.players], deck=self.deck_composition, agents=agents,
+                              headless=headless)
+        # Players must be the same instances, so the snapshot can be restored into the new gamestate as well
+        gamestate.players = list(self.players)
+        gamestate.agents = {player: agent for player, agent in zip(self.players, agents or []) if agent is not None}
+        self.restore(gamestate)
+        return gamestate
+
+    def __eq__(self, other):
+        if not isinstance(other, CompactState):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in CompactState.__slots__)
+
+    def __repr__(self):
+        return (f"CompactState(round={self.round_number}, turn={self.turn_number}, turn_player={self.turn_player}, "
+                f"deck={self.deck.hex()}, hands={[hand.hex() for hand in self.hands]}, "
+                f"discards={[discard_pile.hex() for discard_pile in self.discards]})")
+
+
+def _measure(create, n: int) -> float:
+    """ :return: Bytes allocated per object by `create()`, averaged over `n` objects. """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objects = [create() for _ in range(n)]
+    allocated = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del objects
+    return allocated / n
+
+
+def _time(function, n: int) -> float:
+    """ :return: Microseconds per call of `function()`. """
+    started = time.perf_counter()
+    for _ in range(n):
+        function()
+    return (time.perf_counter() - started) / n * 1e6
+
+
+def main():
+    import copy
+
+    from console import quiet
+
+    # Benchmark with a 4 player table in the middle of its first round
+    with quiet():
+        game = Gamestate(4, seed=1, headless=True)
+        game.initialize_round()
+    for player in game.players:
+        game.discard_pile[player].append(game.deck.pop())
+    snapshot = CompactState.from_gamestate(game)
+    assert CompactState.from_gamestate(snapshot.to_gamestate()) == snapshot
+
+    print(f"Python {sys.version.split()[0]}, 4 players, {len(game.deck)} cards in deck")
+    print(f"Memory per table: Gamestate {_measure(lambda: copy.deepcopy(game), 200):.0f} B, "
+          f"shallow clone {_measure(game.clone, 2000):.0f} B, "
+          f"CompactState {_measure(lambda: CompactState.from_gamestate(game), 2000):.0f} B")
+    print(f"Clone: deepcopy {_time(lambda: copy.deepcopy(game), 500):.1f} µs, "
+          f"Gamestate.clone {_time(game.clone, 5000):.1f} µs, "
+          f"snapshot {_time(lambda: CompactState.from_gamestate(game), 5000):.1f} µs, "
+          f"restore {_time(lambda: snapshot.restore(game), 5000):.1f} µs")
+
+
+if __name__ == '__main__':
+    main()
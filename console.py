@@ -0,0 +1,44 @@
+import sys
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+
+_local = threading.local()
+
+
+class _ThreadAwareStdout:
+    """
+    Replacement for `sys.stdout`, which drops everything written by a thread inside a `quiet()` block.
+    All other threads keep writing to the original stream, e.g. prompts for a human player.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, text: str) -> int:
+        if getattr(_local, "quiet", 0) > 0:
+            return len(text)
+        return self.stream.write(text)
+
+    def __getattr__(self, name: str):
+        return getattr(self.stream, name)
+
+
+_install_lock = threading.Lock()
+
+
+@contextmanager
+def quiet() -> Iterator[None]:
+    """
+    Suppresses all output of the current thread for the duration of the `with` block.
+    Used for headless games, where printing the log would be the most expensive part of the simulation.
+    """
+    if not isinstance(sys.stdout, _ThreadAwareStdout):
+        with _install_lock:
+            if not isinstance(sys.stdout, _ThreadAwareStdout):
+                sys.stdout = _ThreadAwareStdout(sys.stdout)
+    _local.quiet = getattr(_local, "quiet", 0) + 1
+    try:
+        yield
+    finally:
+        _local.quiet -= 1
@@ -0,0 +1,207 @@
+"""
+Decision cache for CPU players. A `CachedAgent` asks its wrapped agent only once per information set and serves
+repeated situations, e.g. the same opening hand with the same public discards, from a bounded LRU cache.
+
+Only deterministic agents which decide on the current state alone should be wrapped. `search_agent.MonteCarloAgent`
+isn't one of them: it keeps state across the decisions of a turn, so after a cached effect selection its later
+decisions of that turn fall back to its heuristic policy.
+
+Usage:
+    cache = DecisionCache(capacity=100000, path="decisions.json")
+    game = Gamestate(3, agents=[CachedAgent(HeuristicAgent(seed=0), cache) for _ in range(3)])
+    ...
+    cache.save()
+"""
+import argparse
+import json
+import os
+import time
+from collections import OrderedDict
+
+from agent import Agent
+from card import Card
+from effect import Effect
+from player import Player
+
+
+def information_set(gamestate: "Gamestate", player: Player) -> str:
+    """
+    Encodes everything `player` knows about the current state in a canonical string: the own hand, the deck size,
+    banished cards, and the discard pile, the flags and the score of every player. Seats are relative to `player`,
+    so the same situation gets the same key at every seat. Cards are sorted, since no rule depends on the order of
+    hands, discard piles or banished cards.
+
+    Knowledge from previous turns, e.g. a hand card revealed by an effect, isn't part of the encoding, so only
+    agents which decide on the current state alone should be cached.
+    """
+    seat = gamestate.players.index(player)
+    players = gamestate.players[seat:] + gamestate.players[:seat]
+    seats = []
+    for other in players:
+        flags = (("o" if other in gamestate.players_out else "")
+                 + ("p" if other in gamestate.players_protected else "")
+                 + ("t" if other is gamestate.turn_player else ""))
+        sanity, madness = gamestate.scores[other]
+        seats.append(f"{','.join(sorted(card.code for card in gamestate.discard_pile[other]))}/{flags}"
+                     f"/{sanity}.{madness}")
+    return (f"{','.join(sorted(card.code for card in gamestate.hands[player]))}"
+            f"|{len(gamestate.deck)}"
+            f"|{','.join(sorted(card.code for card in gamestate.banished_cards))}"
+            f"|{';'.join(seats)}")
+
+
+def resolving(gamestate: "Gamestate") -> str:
+    """
+    :return: Card code and effect of the play being resolved in the current turn, or an empty string before the
+        card to play was selected. The played card is neither in the hand nor on the discard pile while its effect
+        is resolved, so the information set alone doesn't tell which effect a target, card or value is chosen for.
+    """
+    for event in reversed(gamestate.events):
+        if (event.round_number, event.turn_number) != (gamestate.round_number, gamestate.turn_number):
+            break
+        if event.kind == "play":
+            return f"{event.card}:{event.detail}"
+    return ""
+
+
+class DecisionCache:
+    """
+    Bounded LRU cache of decisions by information set, which can be shared by several agents and games.
+    Decisions are stored as the index of the selected option, since options are listed in a deterministic order.
+    """
+
+    def __init__(self, capacity: int = 100000, path: str | None = None):
+        """
+        :param capacity: Maximum number of cached decisions. The least recently used decision is evicted first.
+        :param path: JSON file to warm-start the cache from, if it exists, and to write the cache to in `save()`.
+        """
+        if capacity < 1:
+            raise ValueError("Capacity must be at least 1")
+        self.capacity = capacity
+        self.path = path
+        self.entries: OrderedDict[str, int] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.0
+
+    def get(self, key: str) -> int | None:
+        index = self.entries.get(key)
+        if index is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return index
+
+    def put(self, key: str, index: int) -> None:
+        self.entries[key] = index
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def load(self, path: str) -> None:
+        """ Adds the decisions of a file written by `save()`, keeping their order of use. """
+        with open(path) as f:
+            for key, index in json.load(f):
+                self.put(key, index)
+
+    def save(self, path: str | None = None) -> None:
+        """ Writes all decisions to `path` (default: the path of the cache), least recently used first. """
+        path = path or self.path
+        if path is None:
+            raise ValueError("No path to save the decision cache to")
+        with open(path, "w") as f:
+            json.dump(list(self.entries.items()), f, separators=(",", ":"))
+
+
+class CachedAgent(Agent):
+    """
+    Wraps an agent and caches its decisions per information set (see `information_set`).
+    The wrapped agent should be deterministic, otherwise the first of its random decisions is repeated forever.
+    """
+
+    def __init__(self, agent: Agent, cache: DecisionCache | None = None):
+        """
+        :param agent: Agent making the decisions that aren't cached yet.
+        :param cache: Cache to use, which may be shared with other agents of the same kind. Default is a new cache.
+        """
+        self.agent = agent
+        self.cache = cache if cache is not None else DecisionCache()
+        # Round, turn and relative seat of the last selected target, which a value is usually guessed for
+        self._target: tuple[int, int, int] | None = None
+
+    def _decide(self, key: str, num_options: int, decide) -> int:
+        index = self.cache.get(key)
+        if index is None or index >= num_options:
+            index = decide()
+            self.cache.put(key, index)
+        return index
+
+    def select_effect(self, gamestate: "Gamestate", player: Player, effects: list[Effect]) -> Effect:
+        options = ",".join(f"{effect.card.code}:{effect.effect.__name__}" for effect in effects)
+        key = f"e|{options}|{resolving(gamestate)}|{information_set(gamestate, player)}"
+        return effects[self._decide(key, len(effects),
+                                    lambda: effects.index(self.agent.select_effect(gamestate, player, effects)))]
+
+    def select_target(self, gamestate: "Gamestate", player: Player, targets: list[Player]) -> Player:
+        seat = gamestate.players.index(player)
+        options = ",".join(str((gamestate.players.index(target) - seat) % len(gamestate.players)) for target in targets)
+        key = f"t|{options}|{resolving(gamestate)}|{information_set(gamestate, player)}"
+        target = targets[self._decide(key, len(targets),
+                                      lambda: targets.index(self.agent.select_target(gamestate, player, targets)))]
+        self._target = (gamestate.round_number, gamestate.turn_number,
+                        (gamestate.players.index(target) - seat) % len(gamestate.players))
+        return target
+
+    def select_card(self, gamestate: "Gamestate", player: Player, cards: list[Card]) -> Card:
+        key = f"c|{','.join(card.code for card in cards)}|{resolving(gamestate)}|{information_set(gamestate, player)}"
+        return cards[self._decide(key, len(cards),
+                                  lambda: cards.index(self.agent.select_card(gamestate, player, cards)))]
+
+    def select_value(self, gamestate: "Gamestate", player: Player, start: int, end: int) -> int:
+        target = ""
+        if self._target is not None and self._target[:2] == (gamestate.round_number, gamestate.turn_number):
+            target = str(self._target[2])
+        key = f"v|{start}-{end}|{target}|{resolving(gamestate)}|{information_set(gamestate, player)}"
+        return start + self._decide(key, end - start + 1,
+                                    lambda: self.agent.select_value(gamestate, player, start, end) - start)
+
+
+def main():
+    from heuristic_agent import HeuristicAgent
+    from simulation import play_game
+
+    parser = argparse.ArgumentParser(description="Hit rate and overhead of the decision cache in headless games")
+    parser.add_argument("--games", type=int, default=1000, help="Number of games")
+    parser.add_argument("--players", type=int, default=3, help="Number of players")
+    parser.add_argument("--capacity", type=int, default=100000, help="Maximum number of cached decisions")
+    parser.add_argument("--warm-start", default=None, help="JSON file to load the cache from and save it to")
+    arguments = parser.parse_args()
+
+    cache = DecisionCache(arguments.capacity, arguments.warm_start)
+    print(f"{len(cache)} decision(s) loaded")
+    for label, factory in (("uncached", lambda seed, seat: HeuristicAgent(seed=0)),
+                           ("cached", lambda seed, seat: CachedAgent(HeuristicAgent(seed=0), cache))):
+        started = time.perf_counter()
+        for seed in range(arguments.games):
+            play_game(seed, arguments.players, agent_factory=factory)
+        print(f"{label}: {arguments.games / (time.perf_counter() - started):.0f} games/s")
+    print(f"{cache.hits} hits, {cache.misses} misses ({cache.hit_rate:.1%}), {cache.evictions} evictions, "
+          f"{len(cache)} cached decisions")
+    if arguments.warm_start is not None:
+        cache.save()
+
+
+if __name__ == '__main__':
+    main()
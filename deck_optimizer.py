@@ -0,0 +1,343 @@
+"""
+Searches deck compositions whose simulated outcomes are closest to target shares, e.g. the share of games won by
+summoning Cthulhu (`card8_madness_effect`) or of rounds won with the Shining Trapezohedron (`card7_madness_effect`).
+
+The search is a local search over the card counts: every step evaluates all compositions that differ by one card
+from the current one and moves to the best of them. All compositions are played with the same seeds (common random
+numbers), so differences between neighbors aren't drowned in the noise of different shuffles. Evaluations are stored
+in a persistent SQLite cache keyed by the count vector and only extended with new seeds, never repeated.
+While a composition has few games, its shares are shrunk towards those of its evaluated neighbors.
+
+Usage:
+    python deck_optimizer.py --players 3 --target game:card8_madness_effect=0.15 --target round:card7_madness_effect=0.05
+    python deck_optimizer.py --players 4 --bounds 8m=1:2 7m=0:3 --fixed-size --jobs 8 --top 5
+"""
+import argparse
+import hashlib
+import json
+import math
+import multiprocessing
+import os
+import sqlite3
+from dataclasses import dataclass
+
+from gamestate import format_deck, load_deck
+from simulation import SimulationStats, heuristic_agents, random_agents, simulate
+
+# Files whose changes change simulated outcomes and thus invalidate cached evaluations
+ENGINE_FILES = ("agent.py", "card.py", "effect.py", "game_end.py", "gamestate.py", "heuristic_agent.py", "player.py",
+                "simulation.py")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS evaluations (
+    setup       TEXT NOT NULL,
+    counts      TEXT NOT NULL,
+    games       INTEGER NOT NULL,
+    stats       TEXT NOT NULL,
+    PRIMARY KEY (setup, counts)
+) WITHOUT ROWID;
+"""
+
+Counts = tuple[int, ...]
+
+
+@dataclass(frozen=True)
+class Target:
+    """
+    Target share of an outcome. `scope` is "game" or "round" and `reason` the reason the game or round ended with,
+    e.g. "card8_madness_effect". The scope "round" with reason "mad" targets rounds won by a mad player.
+    """
+    scope: str
+    reason: str
+    share: float
+
+    @classmethod
+    def parse(cls, text: str) -> "Target":
+        """ Parses a target of the format `<scope>:<reason>=<share>`. """
+        try:
+            scope_reason, share = text.split("=")
+            scope, reason = scope_reason.split(":")
+            target = cls(scope, reason, float(share))
+        except ValueError:
+            raise ValueError(f"Invalid target {text!r}, expected <scope>:<reason>=<share>") from None
+        if scope not in ("game", "round"):
+            raise ValueError(f"Invalid scope {scope!r}, expected game or round")
+        return target
+
+    def count(self, stats: SimulationStats) -> tuple[int, int]:
+        """ :return: Number of games or rounds with the outcome and the total number of games or rounds. """
+        if self.scope == "game":
+            return stats.game_win_types[self.reason], stats.games
+        if self.reason == "mad":
+            return stats.mad_round_wins, stats.rounds
+        return stats.round_win_types[self.reason], stats.rounds
+
+    def __str__(self):
+        return f"{self.scope}:{self.reason}={self.share:g}"
+
+
+@dataclass
+class Estimate:
+    counts: Counts
+    games: int
+    # Estimated share and its standard error per target
+    shares: list[float]
+    errors: list[float]
+    objective: float
+    objective_error: float
+
+
+def engine_fingerprint() -> str:
+    """ :return: Hash of the rules and agents, see `ENGINE_FILES`. """
+    digest = hashlib.sha256()
+    for name in ENGINE_FILES:
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), name), "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+def evaluate_task(arguments: tuple[list[str], Counts, int, bool, int, int]) -> tuple[Counts, int, dict]:
+    """ Plays the games of seeds `start` to `end - 1` with the composition `counts` in a worker process. """
+    codes, counts, num_players, random, start, end = arguments
+    stats = simulate(range(start, end), num_players, dict(zip(codes, counts)),
+                     random_agents if random else heuristic_agents)
+    return counts, end, stats.to_dict()
+
+
+class DeckOptimizer:
+    """
+    Local search over deck compositions. Estimates of all evaluated compositions are kept in memory and persisted
+    to the cache after every batch.
+    """
+
+    def __init__(self, start: dict[str, int], bounds: dict[str, tuple[int, int]], targets: list[Target],
+                 num_players: int = 3, random: bool = False, fixed_size: bool = False, batch_games: int = 200,
+                 prior_strength: float = 50.0, cache_path: str = "deck_cache.sqlite", jobs: int = 1):
+        """
+        :param start: Composition to start the search from.
+        :param bounds: Minimum and maximum count per card code. Codes without bounds keep their count from `start`.
+        :param targets: Target shares. The objective is the sum of squared errors of all shares.
+        :param num_players: Number of players.
+        :param random: Simulate games between random agents instead of heuristic agents.
+        :param fixed_size: Keep the number of cards in the deck, i.e. only move cards between codes.
+        :param batch_games: Number of games per evaluation batch.
+        :param prior_strength: Weight of the neighbors' shares in games (or rounds) when estimating shares.
+        :param cache_path: Path of the SQLite database with cached evaluations.
+        :param jobs: Number of processes.
+        """
+        self.codes = list(start)
+        self.start: Counts = tuple(start[code] for code in self.codes)
+        self.bounds = [bounds.get(code, (n, n)) for code, n in zip(self.codes, self.start)]
+        for code, (low, high), n in zip(self.codes, self.bounds, self.start):
+            if not low <= n <= high:
+                raise ValueError(f"Start count {n} of {code} is outside of its bounds {low}..{high}")
+        self.targets = targets
+        self.num_players = num_players
+        self.random = random
+        self.fixed_size = fixed_size
+        self.batch_games = batch_games
+        self.prior_strength = prior_strength
+        self.jobs = jobs
+        # The hands and the first draw must be possible, including the cards banished with 2 players
+        self.min_size = num_players + 1 + (5 if num_players == 2 else 0)
+        if len(self.neighbors(self.start)) == 0:
+            if fixed_size:
+                raise ValueError("Bounds allow no move with a fixed deck size: at least one card code must be able "
+                                 "to take a card and another one to give one up")
+            raise ValueError("Bounds allow no move: at least one card code needs a range")
+        self.setup = json.dumps({"engine": engine_fingerprint(), "players": num_players, "random": random,
+                                 "codes": self.codes})
+        self.connection = sqlite3.connect(cache_path, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+        self.results: dict[Counts, tuple[int, SimulationStats]] = {}
+        for counts, games, stats in self.connection.execute(
+                "SELECT counts, games, stats FROM evaluations WHERE setup = ?", (self.setup,)):
+            self.results[tuple(json.loads(counts))] = games, SimulationStats.from_dict(json.loads(stats))
+        self.cached = len(self.results)
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __enter__(self) -> "DeckOptimizer":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    def neighbors(self, counts: Counts) -> list[Counts]:
+        """ :return: All valid compositions which differ by one card from `counts`, or by moving one card. """
+        added, removed = [], []
+        for i, (n, (low, high)) in enumerate(zip(counts, self.bounds)):
+            if n < high:
+                added.append(i)
+            if n > low:
+                removed.append(i)
+        neighbors = []
+        if self.fixed_size:
+            for i in added:
+                for j in removed:
+                    if i != j:
+                        neighbor = list(counts)
+                        neighbor[i] += 1
+                        neighbor[j] -= 1
+                        neighbors.append(tuple(neighbor))
+        else:
+            for i, delta in [(i, 1) for i in added] + [(j, -1) for j in removed]:
+                neighbor = list(counts)
+                neighbor[i] += delta
+                neighbors.append(tuple(neighbor))
+        return [neighbor for neighbor in neighbors if sum(neighbor) >= self.min_size]
+
+    def evaluate(self, candidates: list[Counts], games: int) -> None:
+        """
+        Makes sure every candidate has been played with at least the seeds `0` to `games - 1`. Missing seeds are
+        played in parallel and stored in the cache.
+        """
+        tasks = []
+        for counts in candidates:
+            done = self.results[counts][0] if counts in self.results else 0
+            for start in range(done, games, self.batch_games):
+                tasks.append((self.codes, counts, self.num_players, self.random, start,
+                              min(start + self.batch_games, games)))
+        if len(tasks) == 0:
+            return
+        if self.jobs > 1:
+            with multiprocessing.Pool(self.jobs) as pool:
+                outcomes = pool.map(evaluate_task, tasks, chunksize=1)
+        else:
+            outcomes = [evaluate_task(task) for task in tasks]
+        for counts, end, stats in outcomes:
+            # Tasks of a composition cover consecutive seed ranges, so the highest end is the number of games
+            done, total = self.results.get(counts, (0, SimulationStats()))
+            self.results[counts] = max(done, end), total + SimulationStats.from_dict(stats)
+        self.connection.execute("BEGIN IMMEDIATE")
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO evaluations VALUES (?, ?, ?, ?)",
+            [(self.setup, json.dumps(counts), self.results[counts][0], json.dumps(self.results[counts][1].to_dict()))
+             for counts in {counts for counts, _, _ in outcomes}])
+        self.connection.execute("COMMIT")
+
+    def estimate(self, counts: Counts) -> Estimate:
+        """
+        Estimates the shares of an evaluated composition. The shares of evaluated neighbors act as a prior
+        worth `prior_strength` games (or rounds), which matters only as long as the composition has few games.
+        """
+        games, stats = self.results[counts]
+        neighbor_stats = [self.results[neighbor][1] for neighbor in self.neighbors(counts) if neighbor in self.results]
+        shares, errors = [], []
+        objective, objective_variance = 0.0, 0.0
+        for target in self.targets:
+            hits, total = target.count(stats)
+            neighbor_hits = sum(target.count(neighbor)[0] for neighbor in neighbor_stats)
+            neighbor_total = sum(target.count(neighbor)[1] for neighbor in neighbor_stats)
+            weight = self.prior_strength if neighbor_total > 0 else 0.0
+            prior = neighbor_hits / neighbor_total if neighbor_total > 0 else 0.0
+            share = (hits + weight * prior) / (total + weight) if total + weight > 0 else 0.0
+            error = math.sqrt(share * (1 - share) / (total + weight)) if total + weight > 0 else 0.5
+            shares.append(share)
+            errors.append(error)
+            objective += (share - target.share) ** 2
+            # Delta method, ignoring correlations between the shares
+            objective_variance += (2 * (share - target.share) * error) ** 2 + 2 * error ** 4
+        return Estimate(counts, games, shares, errors, objective, math.sqrt(objective_variance))
+
+    def search(self, steps: int = 20, refine: int = 3) -> Estimate:
+        """
+        Moves to the best neighbor until no neighbor is better than the current composition.
+
+        :param steps: Maximum number of moves.
+        :param refine: Number of the best neighbors which get twice as many games per step before moving,
+            so moves aren't decided by the noise of a single batch.
+        :return: Estimate of the composition the search stopped at.
+        """
+        current = self.start
+        self.evaluate([current], 2 * self.batch_games)
+        for step in range(steps):
+            neighbors = self.neighbors(current)
+            if len(neighbors) == 0:
+                print(f"Step {step + 1}: no valid neighbor")
+                break
+            self.evaluate(neighbors, self.batch_games)
+            best = sorted(neighbors, key=lambda counts: self.estimate(counts).objective)[:refine]
+            required = max(2 * self.batch_games, self.results[current][0])
+            self.evaluate(best + [current], required)
+            best_neighbor = min(best, key=lambda counts: self.estimate(counts).objective)
+            current_estimate, neighbor_estimate = self.estimate(current), self.estimate(best_neighbor)
+            print(f"Step {step + 1}: objective {current_estimate.objective:.5f}, best neighbor "
+                  f"{neighbor_estimate.objective:.5f} ({self.describe_move(current, best_neighbor)})")
+            if neighbor_estimate.objective >= current_estimate.objective:
+                break
+            current = best_neighbor
+        return self.estimate(current)
+
+    def describe_move(self, old: Counts, new: Counts) -> str:
+        return ", ".join(f"{code} {a}->{b}" for code, a, b in zip(self.codes, old, new) if a != b)
+
+    def ranking(self, min_games: int | None = None) -> list[Estimate]:
+        """ :return: All evaluated compositions with at least `min_games` games, best first. """
+        min_games = min_games if min_games is not None else 2 * self.batch_games
+        estimates = [self.estimate(counts) for counts, (games, _) in self.results.items() if games >= min_games
+                     and all(low <= n <= high for n, (low, high) in zip(counts, self.bounds))]
+        return sorted(estimates, key=lambda estimate: estimate.objective)
+
+    def deck(self, counts: Counts) -> dict[str, int]:
+        return dict(zip(self.codes, counts))
+
+
+def parse_bounds(texts: list[str]) -> dict[str, tuple[int, int]]:
+    """ Parses bounds of the format `<card_code>=<min>:<max>`. """
+    bounds = {}
+    for text in texts:
+        code, bound = text.split("=")
+        low, high = bound.split(":")
+        bounds[code] = int(low), int(high)
+    return bounds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search deck compositions with target outcome shares")
+    parser.add_argument("--deck", default="deck.txt", help="Deck file to start from")
+    parser.add_argument("--players", type=int, default=3, help="Number of players")
+    parser.add_argument("--target", action="append", type=Target.parse,
+                        help="Target share as <scope>:<reason>=<share>, e.g. game:card8_madness_effect=0.15 or "
+                             "round:mad=0.3. Can be given multiple times.")
+    parser.add_argument("--bounds", nargs="*", default=None,
+                        help="Bounds as <card_code>=<min>:<max>. Default is the start count +-1 for every card "
+                             "except the Cylinder (0m)")
+    parser.add_argument("--fixed-size", action="store_true", help="Keep the number of cards in the deck")
+    parser.add_argument("--random", action="store_true", help="Use random agents instead of heuristic agents")
+    parser.add_argument("--batch-games", type=int, default=200, help="Games per evaluation batch")
+    parser.add_argument("--prior-strength", type=float, default=50.0,
+                        help="Weight of the neighbors' shares, in games or rounds")
+    parser.add_argument("--steps", type=int, default=20, help="Maximum number of moves")
+    parser.add_argument("--top", type=int, default=3, help="Number of decks to print")
+    parser.add_argument("--cache", default="deck_cache.sqlite", help="Path of the evaluation cache")
+    parser.add_argument("--jobs", type=int, default=multiprocessing.cpu_count(), help="Number of processes")
+    arguments = parser.parse_args()
+
+    start = load_deck(arguments.deck)
+    targets = arguments.target or [Target("game", "card8_madness_effect", 0.15)]
+    if arguments.bounds is None:
+        bounds = {code: (max(n - 1, 0), n + 1) for code, n in start.items() if code != "0m"}
+    else:
+        bounds = parse_bounds(arguments.bounds)
+    try:
+        optimizer = DeckOptimizer(start, bounds, targets, arguments.players, arguments.random, arguments.fixed_size,
+                                  arguments.batch_games, arguments.prior_strength, arguments.cache, arguments.jobs)
+    except ValueError as e:
+        parser.error(str(e))
+    with optimizer:
+        print(f"Targets: {', '.join(map(str, targets))}, {optimizer.cached} cached composition(s)")
+        optimizer.search(arguments.steps)
+        for rank, estimate in enumerate(optimizer.ranking()[:arguments.top], start=1):
+            shares = ", ".join(f"{target.scope}:{target.reason} {share:.3f} ± {1.96 * error:.3f}"
+                               for target, share, error in zip(targets, estimate.shares, estimate.errors))
+            print(f"\n#{rank}: objective {estimate.objective:.5f} ± {1.96 * estimate.objective_error:.5f} "
+                  f"over {estimate.games} games ({shares})")
+            print(f"  changes: {optimizer.describe_move(optimizer.start, estimate.counts) or 'none'}")
+            print(format_deck(optimizer.deck(estimate.counts)), end="")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,309 @@
+"""
+Distributed simulations. A coordinator hands out seed ranges and deck configurations over TCP, workers on any node
+play the headless games and send back aggregated `SimulationStats`.
+
+Messages are single-line JSON objects. Workers ask for work with a "request" message and get a "task", "wait" or
+"done" message back. Results are sent as "result" messages and are deduplicated by task, which is identified by its
+configuration and seed range. Tasks of workers which disconnect or exceed their lease are handed out again, so every
+seed range is simulated at least once, but only counted once. Idle workers steal outstanding tasks from slow workers
+once the queue is empty, whichever copy finishes first is used.
+
+Usage:
+    python distributed.py coordinator --games 1000000 --players 2 3 4 --deck deck.txt --port 5577
+    python distributed.py worker --host 10.0.0.1 --port 5577 --processes 8
+    python distributed.py local --games 20000 --players 3 --workers 4
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import socketserver
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+
+from gamestate import load_deck
+from simulation import SimulationStats, simulate
+
+
+@dataclass(frozen=True)
+class SimulationConfig:
+    num_players: int
+    deck: tuple[tuple[str, int], ...]
+
+    @classmethod
+    def create(cls, num_players: int, deck: str | dict[str, int] = "deck.txt") -> "SimulationConfig":
+        deck = load_deck(deck) if isinstance(deck, str) else deck
+        return cls(num_players, tuple(sorted(deck.items())))
+
+
+@dataclass
+class Task:
+    task_id: str
+    config_index: int
+    start: int
+    end: int
+    assignees: set[str] = field(default_factory=set)
+    leased_at: float = 0.0
+
+    def message(self, config: SimulationConfig) -> dict:
+        return {"type": "task", "task": self.task_id, "seeds": [self.start, self.end],
+                "players": config.num_players, "deck": dict(config.deck)}
+
+
+class Coordinator:
+    """
+    Hands out seed ranges of all configurations to workers and collects their results.
+    All state is guarded by `self.condition`, since every worker connection is handled in its own thread.
+    """
+
+    def __init__(self, configs: list[SimulationConfig], games: int, chunk_size: int = 1000,
+                 host: str = "0.0.0.0", port: int = 5577, lease_timeout: float = 600.0, steal_after: float = 5.0):
+        """
+        :param configs: Configurations to simulate.
+        :param games: Number of games per configuration. Seeds `0` to `games - 1` are used for every configuration.
+        :param chunk_size: Number of seeds per task.
+        :param host: Address to listen on.
+        :param port: Port to listen on. Use `0` to pick a free port, see `self.address`.
+        :param lease_timeout: Seconds after which a task is handed out again, even if its worker is still connected.
+        :param steal_after: Seconds a task has to be in progress before an idle worker may steal it.
+        """
+        self.configs = configs
+        self.lease_timeout = lease_timeout
+        self.steal_after = steal_after
+        self.tasks: dict[str, Task] = {}
+        for config_index in range(len(configs)):
+            for start in range(0, games, chunk_size):
+                end = min(start + chunk_size, games)
+                task = Task(f"{config_index}:{start}:{end}", config_index, start, end)
+                self.tasks[task.task_id] = task
+        self.pending: deque[str] = deque(self.tasks)
+        self.results: dict[str, SimulationStats] = {}
+        self.duplicates = 0
+        self.reassigned = 0
+        self.condition = threading.Condition()
+        self.server = socketserver.ThreadingTCPServer((host, port), self._handler_class(), bind_and_activate=True)
+        self.server.daemon_threads = True
+        self.address = self.server.server_address
+
+    @property
+    def done(self) -> bool:
+        return len(self.results) == len(self.tasks)
+
+    def _handler_class(self):
+        coordinator = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self) -> None:
+                worker_id = None
+                try:
+                    for line in self.rfile:
+                        message = json.loads(line)
+                        worker_id = message["worker"]
+                        if message["type"] == "result":
+                            coordinator.complete(worker_id, message["task"],
+                                                 SimulationStats.from_dict(message["stats"]))
+                        elif message["type"] == "request":
+                            reply = coordinator.next_message(worker_id)
+                            self.wfile.write((json.dumps(reply) + "\n").encode())
+                except (ConnectionError, json.JSONDecodeError):
+                    pass
+                finally:
+                    if worker_id is not None:
+                        coordinator.worker_lost(worker_id)
+
+        return Handler
+
+    def next_message(self, worker_id: str) -> dict:
+        """ Determines the next message for a worker requesting work. """
+        with self.condition:
+            now = time.monotonic()
+            self._expire_leases(now)
+            while len(self.pending) > 0:
+                task = self.tasks[self.pending.popleft()]
+                if task.task_id not in self.results:
+                    return self._assign(task, worker_id, now)
+            if self.done:
+                return {"type": "done"}
+            # Queue is empty, steal the oldest task in progress from another worker
+            candidates = [task for task in self.tasks.values()
+                          if task.task_id not in self.results and worker_id not in task.assignees
+                          and now - task.leased_at >= self.steal_after]
+            if len(candidates) > 0:
+                task = min(candidates, key=lambda t: (len(t.assignees), t.leased_at))
+                return self._assign(task, worker_id, task.leased_at)
+            return {"type": "wait", "seconds": 0.5}
+
+    def _assign(self, task: Task, worker_id: str, leased_at: float) -> dict:
+        task.assignees.add(worker_id)
+        task.leased_at = leased_at
+        return task.message(self.configs[task.config_index])
+
+    def _expire_leases(self, now: float) -> None:
+        for task in self.tasks.values():
+            if (task.task_id not in self.results and len(task.assignees) > 0
+                    and now - task.leased_at > self.lease_timeout):
+                task.assignees.clear()
+                self._requeue(task)
+
+    def _requeue(self, task: Task) -> None:
+        if task.task_id not in self.pending:
+            self.pending.appendleft(task.task_id)
+            self.reassigned += 1
+
+    def complete(self, worker_id: str, task_id: str, stats: SimulationStats) -> None:
+        """ Stores the result of a task, unless another worker already finished the same seed range. """
+        with self.condition:
+            task = self.tasks[task_id]
+            task.assignees.discard(worker_id)
+            if task_id in self.results:
+                self.duplicates += 1
+                return
+            self.results[task_id] = stats
+            self.condition.notify_all()
+
+    def worker_lost(self, worker_id: str) -> None:
+        """ Hands out all unfinished tasks of a disconnected worker again. """
+        with self.condition:
+            for task in self.tasks.values():
+                if worker_id in task.assignees:
+                    task.assignees.discard(worker_id)
+                    if task.task_id not in self.results and len(task.assignees) == 0:
+                        self._requeue(task)
+
+    def run(self) -> dict[SimulationConfig, SimulationStats]:
+        """
+        Serves workers until all tasks are finished.
+
+        :return: Aggregated stats per configuration.
+        """
+        server_thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        server_thread.start()
+        try:
+            with self.condition:
+                self.condition.wait_for(lambda: self.done)
+            # Give connected workers the chance to receive their "done" message
+            time.sleep(1)
+        finally:
+            self.server.shutdown()
+            self.server.server_close()
+        totals = {config: SimulationStats() for config in self.configs}
+        for task_id, stats in self.results.items():
+            config = self.configs[self.tasks[task_id].config_index]
+            totals[config] = totals[config] + stats
+        return totals
+
+
+def worker_loop(host: str, port: int, connect_timeout: float = 30.0) -> None:
+    """
+    Connects to a coordinator and simulates tasks until the coordinator is done or goes away.
+
+    :param host: Host of the coordinator.
+    :param port: Port of the coordinator.
+    :param connect_timeout: Seconds to keep retrying, if the coordinator isn't reachable yet.
+    """
+    worker_id = f"{socket.gethostname()}-{os.getpid()}"
+    deadline = time.monotonic() + connect_timeout
+    while True:
+        try:
+            connection = socket.create_connection((host, port))
+            break
+        except ConnectionError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.5)
+
+    with connection, connection.makefile("rwb") as stream:
+        def send(message: dict) -> None:
+            stream.write((json.dumps({**message, "worker": worker_id}) + "\n").encode())
+            stream.flush()
+
+        while True:
+            try:
+                send({"type": "request"})
+                line = stream.readline()
+            except ConnectionError:
+                return
+            if not line:
+                return
+            message = json.loads(line)
+            if message["type"] == "done":
+                return
+            if message["type"] == "wait":
+                time.sleep(message["seconds"])
+                continue
+            start, end = message["seeds"]
+            stats = simulate(range(start, end), message["players"], message["deck"])
+            try:
+                send({"type": "result", "task": message["task"], "stats": stats.to_dict()})
+            except ConnectionError:
+                return
+
+
+def run_workers(host: str, port: int, processes: int) -> None:
+    """ Runs `processes` workers in separate processes and waits until all of them finished. """
+    workers = [multiprocessing.Process(target=worker_loop, args=(host, port)) for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+def run_local(configs: list[SimulationConfig], games: int, workers: int = multiprocessing.cpu_count(),
+              chunk_size: int = 1000) -> dict[SimulationConfig, SimulationStats]:
+    """ Runs a coordinator and `workers` worker processes on localhost. """
+    coordinator = Coordinator(configs, games, chunk_size, host="127.0.0.1", port=0)
+    # The coordinator is already listening, so workers can be started before it serves any connection
+    worker_processes = [multiprocessing.Process(target=worker_loop, args=coordinator.address) for _ in range(workers)]
+    for worker in worker_processes:
+        worker.start()
+    results = coordinator.run()
+    for worker in worker_processes:
+        worker.join()
+    return results
+
+
+def print_results(results: dict[SimulationConfig, SimulationStats]) -> None:
+    for config, stats in results.items():
+        print(f"{config.num_players} players, {stats.games} games, {stats.rounds} rounds, "
+              f"{stats.turns / max(stats.rounds, 1):.1f} turns per round")
+        print(f"  Win rate per seat: {', '.join(f'{wins / max(stats.games, 1):.3f}' for wins in stats.seat_wins)}")
+        print(f"  Round endings: {dict(stats.round_win_types.most_common())}")
+        print(f"  Game endings: {dict(stats.game_win_types.most_common())}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Distributed Lovecraft Letter simulations")
+    subparsers = parser.add_subparsers(dest="mode", required=True)
+    for mode in ("coordinator", "local"):
+        subparser = subparsers.add_parser(mode)
+        subparser.add_argument("--games", type=int, default=10000, help="Games per configuration")
+        subparser.add_argument("--players", type=int, nargs="+", default=[2, 3, 4], help="Player counts")
+        subparser.add_argument("--deck", nargs="+", default=["deck.txt"], help="Deck files")
+        subparser.add_argument("--chunk-size", type=int, default=1000, help="Seeds per task")
+    subparsers.choices["coordinator"].add_argument("--port", type=int, default=5577)
+    subparsers.choices["local"].add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    worker_parser = subparsers.add_parser("worker")
+    worker_parser.add_argument("--host", default="127.0.0.1")
+    worker_parser.add_argument("--port", type=int, default=5577)
+    worker_parser.add_argument("--processes", type=int, default=multiprocessing.cpu_count())
+    arguments = parser.parse_args()
+
+    if arguments.mode == "worker":
+        run_workers(arguments.host, arguments.port, arguments.processes)
+        return
+    configs = [SimulationConfig.create(players, deck) for deck in arguments.deck for players in arguments.players]
+    if arguments.mode == "coordinator":
+        coordinator = Coordinator(configs, arguments.games, arguments.chunk_size, port=arguments.port)
+        print(f"Coordinator listening on {coordinator.address[0]}:{coordinator.address[1]}")
+        results = coordinator.run()
+        print(f"{coordinator.reassigned} task(s) reassigned, {coordinator.duplicates} duplicate result(s) ignored")
+    else:
+        results = run_local(configs, arguments.games, arguments.workers, arguments.chunk_size)
+    print_results(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -8,7 +8,7 @@ from game_end import RoundEndException, GameOverException
 from player import Player
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Effect:
     card: "Card"
     effect: Callable[["Gamestate", Player], None]
@@ -73,7 +73,7 @@ class Effect:
         Determines, whether this effect can be activated, considering the madness status of the player.
         If the player is not mad and this effect is a madness effect, it cannot be activated.
         """
-        return player in gamestate.players_mad or not self.is_madness
+        return not self.is_madness or player in gamestate.players_mad
 
     def activation_silver_key_restriction(self, gamestate: "Gamestate", player: Player) -> bool:
         """
@@ -162,7 +162,8 @@ def card3_effect(gamestate: "Gamestate", activating_player: Player):
 
 def card3_madness_effect(gamestate: "Gamestate", activating_player: Player):
     player_target = gamestate.select_target_player(activating_player,
-                                                   custom_target_filter=lambda p: p in gamestate.players_mad)
+                                                   custom_target_filter=lambda game, target, activator:
+                                                   target not in game.players_mad)
     if player_target is None:
         print(f"{Fore.CYAN}No target available, effect cannot activate.{Fore.RESET}")
         return
@@ -186,7 +187,9 @@ def card5_effect(gamestate: "Gamestate", activating_player: Player):
         return
     print(f"{Fore.YELLOW}{player_target.name} {Fore.CYAN}cannot hold onto their card ...{Fore.RESET}")
     gamestate.discard_card(player_target, gamestate.hands[player_target][0])
-    gamestate.draw_card(player_target)
+    # Discarding some cards eliminates the player, who must not draw a new card then
+    if player_target not in gamestate.players_out:
+        gamestate.draw_card(player_target)
 
 
 def card5_madness_effect(gamestate: "Gamestate", activating_player: Player):
@@ -198,11 +201,11 @@ def card5_madness_effect(gamestate: "Gamestate", activating_player: Player):
         return
 
     stolen_card = gamestate.hands[player_target].pop(0)
-    gamestate.hands[player_target].append(stolen_card)
+    gamestate.hands[activating_player].append(stolen_card)
     print(f"{Fore.YELLOW}{activating_player.name} {Fore.RESET} stole a card from {Fore.YELLOW}{player_target.name}!"
           f"{Fore.RESET}")
 
-    gamestate.hands[player_target].append(Card("0m"))
+    gamestate.hands[player_target].append(Card.by_code("0m"))
     print(f"{Fore.YELLOW}{player_target.name} {Fore.RESET}received the 'Brain's Cylinder of the Mi-Go' ...{Fore.RESET}")
 
     print(f"{Fore.GREEN}The Void demands a card to be played ...{Fore.RESET}")
@@ -223,16 +226,19 @@ def card6_effect(gamestate: "Gamestate", activating_player: Player):
 
 
 def card6_madness_effect(gamestate: "Gamestate", activating_player: Player):
-    target_players = gamestate.players_in_game - gamestate.players_protected - {activating_player}
+    target_players = [player for player in gamestate.players_in_game
+                      if player not in gamestate.players_protected and player != activating_player]
     if len(target_players) < 2:
         print(f"{Fore.CYAN}Not enough valid targets to switch hands around.{Fore.RESET}")
         return
     cards = [gamestate.hands[p].pop(0) for p in target_players]
     while len(cards) > 0:
+        # Every player gets exactly one card back, so only players with an empty hand are valid targets
         tar_player = gamestate.select_target_player(activating_player,
                                                     apply_default_target_filter=False,
-                                                    custom_target_filter=lambda x, target, y: target in target_players)
-        tar_card = gamestate.select_card_from(cards)
+                                                    custom_target_filter=lambda game, target, activator:
+                                                    target in target_players and len(game.hands[target]) == 0)
+        tar_card = gamestate.select_card_from(cards, activating_player)
         cards.remove(tar_card)
         gamestate.hands[tar_player].append(tar_card)
         print(f"{Fore.YELLOW}{tar_player.name} {Fore.RESET}received a card ...")
@@ -246,7 +252,7 @@ def card7_madness_effect(gamestate: "Gamestate", activating_player: Player):
     if any(card.value >= 5 for card in gamestate.hands[activating_player]):
         print(f"{Fore.YELLOW}{activating_player.name}{Fore.RESET}'s 'Shining Trapezohedron' surges with power, "
               f"{Fore.RED}instantly eliminating all other players!{Fore.RESET}")
-        raise RoundEndException(activating_player)
+        raise RoundEndException(activating_player, "card7_madness_effect")
     else:
         card7_effect(gamestate, activating_player)
 
@@ -264,7 +270,7 @@ def card8_madness_effect(gamestate: "Gamestate", activating_player: Player):
     madness_cards = [card for card in gamestate.discard_pile[activating_player] if card.effect_madness is not None]
     if len(madness_cards) >= 2:
         print(f"{Fore.YELLOW}{activating_player.name}{Fore.GREEN} has summoned Cthulhu and wins the game!{Fore.RESET}")
-        raise GameOverException(activating_player)
+        raise GameOverException(activating_player, "card8_madness_effect")
     else:
         print(f"{Fore.YELLOW}{activating_player.name}{Fore.GREEN} is consumed by the Void ...{Fore.RESET}")
         gamestate.eliminate_player(activating_player)
@@ -279,6 +285,7 @@ def nop_effect(gamestate: "Gamestate", activating_player: Player):
 
 
 EFFECT_CODES: dict[str, Callable[["Gamestate", Player], None]] = defaultdict(lambda: nop_effect, {
+    "0": card0_effect,
     "0m": card0_effect,
     "0md": card0_effect,
     "1": card1_effect,
@@ -302,6 +309,7 @@ EFFECT_CODES: dict[str, Callable[["Gamestate", Player], None]] = defaultdict(lam
 })
 
 EFFECT_DESCRIPTIONS: dict[str, str] = defaultdict(lambda: "Nothing will happen ...", {
+    "0": "Wenn du diese Karte spielst oder ablegst, scheidest du aus.",
     "0m": "Wenn du diese Karte spielst oder ablegst, scheidest du aus.",
     "1": "Errätst du den Wert der Handkarte eines Mitspielers (außer der '1'), scheidet dieser aus.",
     "1m": "Besitzt die Handkarte eines Mitspieler eine '1', scheidet dieser aus. Wenn nicht, wende die normale "
@@ -0,0 +1,362 @@
+"""
+Randomized rules fuzzer. Plays huge numbers of headless games with random legal decisions, checks invariants after
+every turn and reports shrunk reproducers for every distinct failure.
+
+Usage:
+    python fuzz.py --games 100000 --players 2 3 4 5 6 --deck deck.txt --jobs 8
+    python fuzz.py --replay --seed 1234 --players 3 --deck deck.txt --choices 0,2,1
+"""
+import argparse
+import dis
+import multiprocessing
+import random
+import sys
+import time
+import traceback
+from collections import Counter
+from dataclasses import dataclass, field
+
+import effect
+from agent import Agent
+from card import Card, CREATED_CARD_CODES
+from effect import Effect
+from gamestate import Gamestate, GameEvent
+from player import Player
+
+# Games that take more rounds than this are considered stuck
+MAX_ROUNDS = 200
+
+
+class InvariantViolation(Exception):
+    def __init__(self, invariant: str, message: str):
+        self.invariant = invariant
+        super().__init__(f"[{invariant}] {message}")
+
+
+class ChoiceStream:
+    """
+    Sequence of decisions shared by all agents of a fuzzed game. Every decision between `n` options consumes one
+    integer of the stream. Decisions are recorded, so a game can be replayed from the seed and its choices alone.
+
+    The first decisions are taken from `prefix`. After that, decisions are random if an `rng` is given and
+    otherwise always the first option, which is what shrinking relies on.
+    """
+
+    def __init__(self, prefix: list[int] | tuple[int, ...] = (), rng: random.Random | None = None):
+        self.prefix = prefix
+        self.rng = rng
+        self.choices: list[int] = []
+
+    def pick(self, n: int) -> int:
+        position = len(self.choices)
+        if position < len(self.prefix):
+            choice = self.prefix[position] % n
+        elif self.rng is not None:
+            choice = self.rng.randrange(n)
+        else:
+            choice = 0
+        self.choices.append(choice)
+        return choice
+
+
+class FuzzAgent(Agent):
+    """ Agent that takes all its decisions from a `ChoiceStream`. """
+
+    def __init__(self, stream: ChoiceStream):
+        self.stream = stream
+
+    def select_effect(self, gamestate: Gamestate, player: Player, effects: list[Effect]) -> Effect:
+        return effects[self.stream.pick(len(effects))]
+
+    def select_target(self, gamestate: Gamestate, player: Player, targets: list[Player]) -> Player:
+        return targets[self.stream.pick(len(targets))]
+
+    def select_card(self, gamestate: Gamestate, player: Player, cards: list[Card]) -> Card:
+        return cards[self.stream.pick(len(cards))]
+
+    def select_value(self, gamestate: Gamestate, player: Player, start: int, end: int) -> int:
+        return start + self.stream.pick(end - start + 1)
+
+
+class InvariantChecker:
+    """
+    Checks the invariants of a `Gamestate` after every turn. Registered as an `after_turn_hook`, so it only sees
+    consistent states between turns.
+    """
+
+    def __init__(self, gamestate: Gamestate):
+        self.expected_cards = Counter({code: n for code, n in gamestate.deck_composition.items()
+                                       if code not in CREATED_CARD_CODES and n > 0})
+        self.round_number = None
+        self.players_out_before = set()
+        self.events_seen = 0
+
+    def __call__(self, gamestate: Gamestate) -> None:
+        if gamestate.round_number != self.round_number:
+            self.round_number = gamestate.round_number
+            self.players_out_before = set()
+        if gamestate.round_number > MAX_ROUNDS:
+            raise InvariantViolation("termination", f"Game did not end after {MAX_ROUNDS} rounds")
+
+        all_cards = gamestate.deck + gamestate.banished_cards
+        for player in gamestate.players:
+            all_cards += gamestate.hands[player]
+            all_cards += gamestate.discard_pile[player]
+        cards = Counter([card.code for card in all_cards])
+        for code in CREATED_CARD_CODES:
+            del cards[code]
+        if cards != self.expected_cards:
+            difference = (cards - self.expected_cards) + Counter({code: -n for code, n in
+                                                                   (self.expected_cards - cards).items()})
+            raise InvariantViolation("card_conservation", f"Cards differ from the deck: {dict(difference)}")
+
+        for player in gamestate.players:
+            hand_size = len(gamestate.hands[player])
+            if player in gamestate.players_out and hand_size != 0:
+                raise InvariantViolation("hand_size", f"{player.name} is out, but holds {hand_size} card(s)")
+            if player not in gamestate.players_out and hand_size != 1:
+                raise InvariantViolation("hand_size", f"{player.name} is waiting with {hand_size} card(s)")
+
+        if gamestate.turn_player in gamestate.players_out:
+            raise InvariantViolation("eliminated_acting", f"{gamestate.turn_player.name} is out, but has the turn")
+        for event in gamestate.events[self.events_seen:]:
+            if event.kind == "play" and gamestate.players[event.player] in self.players_out_before:
+                raise InvariantViolation("eliminated_acting",
+                                         f"{gamestate.players[event.player].name} played a card while being out")
+        self.events_seen = len(gamestate.events)
+        self.players_out_before = set(gamestate.players_out)
+
+
+class EffectCoverage:
+    """
+    Records which branches of the effect functions were taken, using `sys.monitoring` (Python 3.12+).
+    Each branch direction is recorded once and then disabled, so coverage costs nothing once a branch is known.
+    """
+
+    def __init__(self):
+        self.arcs: set[tuple[str, int, int]] = set()
+        self.total_branches: dict[str, int] = {}
+        self.enabled = hasattr(sys, "monitoring")
+        self.tool_id = None
+        self._destinations: dict[tuple[str, int], set[int]] = {}
+        self.code_objects = {function.__code__ for function in effect.EFFECT_CODES.values()}
+        for code in self.code_objects:
+            conditional_jumps = [instruction for instruction in dis.get_instructions(code)
+                                 if instruction.opname.startswith("POP_JUMP_IF") or instruction.opname == "FOR_ITER"]
+            self.total_branches[code.co_name] = 2 * len(conditional_jumps)
+
+    def start(self) -> None:
+        if not self.enabled:
+            return
+        monitoring = sys.monitoring
+        self.tool_id = next((tool_id for tool_id in (monitoring.COVERAGE_ID, 3, 4)
+                             if monitoring.get_tool(tool_id) is None), None)
+        if self.tool_id is None:
+            self.enabled = False
+            return
+        monitoring.use_tool_id(self.tool_id, "lovecraft-letter-fuzz")
+        monitoring.register_callback(self.tool_id, monitoring.events.BRANCH, self._on_branch)
+        for code in self.code_objects:
+            monitoring.set_local_events(self.tool_id, code, monitoring.events.BRANCH)
+
+    def stop(self) -> None:
+        if self.tool_id is None:
+            return
+        for code in self.code_objects:
+            sys.monitoring.set_local_events(self.tool_id, code, 0)
+        sys.monitoring.register_callback(self.tool_id, sys.monitoring.events.BRANCH, None)
+        sys.monitoring.free_tool_id(self.tool_id)
+        self.tool_id = None
+
+    def _on_branch(self, code, instruction_offset: int, destination_offset: int):
+        self.arcs.add((code.co_name, instruction_offset, destination_offset))
+        destinations = self._destinations.setdefault((code.co_name, instruction_offset), set())
+        destinations.add(destination_offset)
+        if len(destinations) >= 2:
+            return sys.monitoring.DISABLE
+
+    def report(self) -> dict[str, tuple[int, int]]:
+        """ :return: Taken and total branches per effect function. """
+        taken = Counter(name for name, _, _ in self.arcs)
+        return {name: (taken[name], total) for name, total in sorted(self.total_branches.items())}
+
+
+@dataclass
+class FuzzCase:
+    seed: int
+    num_players: int
+    deck: str
+    choices: list[int] = field(default_factory=list)
+    signature: tuple[str, str] | None = None
+    error: str | None = None
+    events: list[GameEvent] = field(default_factory=list, repr=False)
+
+    def replay_command(self) -> str:
+        return (f"python fuzz.py --replay --seed {self.seed} --players {self.num_players} --deck {self.deck} "
+                f"--choices {','.join(map(str, self.choices)) or '-'}")
+
+
+def error_signature(error: BaseException) -> tuple[str, str]:
+    """ Identifies a failure by its exception type and the innermost line of code it was raised from. """
+    if isinstance(error, InvariantViolation):
+        return "InvariantViolation", error.invariant
+    frame = traceback.extract_tb(error.__traceback__)[-1]
+    return type(error).__name__, f"{frame.filename.rsplit('/', 1)[-1]}:{frame.lineno} {frame.name}"
+
+
+def run_case(seed: int, num_players: int, deck: str, prefix: list[int] | None = None) -> FuzzCase:
+    """
+    Plays one headless game and checks the invariants after every turn.
+
+    :param seed: Seed of the game, which determines the deck order and the random decisions.
+    :param num_players: Number of players.
+    :param deck: Path of the deck file.
+    :param prefix: Decisions to replay. If given, all decisions after the prefix take the first option,
+        otherwise all decisions are random.
+    :return: The played case, with `signature` and `error` set if the game failed.
+    """
+    stream = ChoiceStream(prefix, None) if prefix is not None else ChoiceStream((), random.Random(f"choices-{seed}"))
+    game = Gamestate(num_players, deck=deck, agents=[FuzzAgent(stream)] * num_players, seed=seed, headless=True)
+    game.after_turn_hooks.append(InvariantChecker(game))
+    case = FuzzCase(seed, num_players, deck, stream.choices, events=game.events)
+    try:
+        game.start_game()
+    except Exception as e:
+        case.signature = error_signature(e)
+        case.error = "".join(traceback.format_exception(e)[-4:])
+    return case
+
+
+def case_parameters(seed: int, player_counts: list[int], decks: list[str]) -> tuple[int, str]:
+    """ Maps a seed to the number of players and the deck file, so every seed describes a single case. """
+    return player_counts[seed % len(player_counts)], decks[(seed // len(player_counts)) % len(decks)]
+
+
+def fuzz_seed_range(arguments: tuple[int, int, list[int], list[str], bool]
+                    ) -> tuple[int, dict[tuple, FuzzCase], set, Counter]:
+    """
+    Runs all seeds in `[start, end)`. Used as a worker function for multiprocessing.
+
+    :return: Number of games, first failing case per signature, branch arcs taken and runs per effect function
+        by playing or discarding a card.
+    """
+    start, end, player_counts, decks, measure_coverage = arguments
+    coverage = EffectCoverage()
+    if measure_coverage:
+        coverage.start()
+    failures, plays = {}, Counter()
+    try:
+        for seed in range(start, end):
+            case = run_case(seed, *case_parameters(seed, player_counts, decks))
+            if case.signature is not None and case.signature not in failures:
+                failures[case.signature] = case
+            plays.update(event.detail for event in case.events if event.kind == "play")
+            # Discard effects run without a "play" event, e.g. card8_discard_effect
+            plays.update(effect.EFFECT_CODES[f"{event.card}d"].__name__ for event in case.events
+                         if event.kind == "discard" and f"{event.card}d" in effect.EFFECT_CODES)
+            case.events = []
+    finally:
+        coverage.stop()
+    return end - start, failures, coverage.arcs, plays
+
+
+def shrink(case: FuzzCase, max_runs: int = 2000) -> FuzzCase:
+    """
+    Shrinks the decisions of a failing case, while keeping the failure signature the same.
+    Decisions are first removed in chunks and then lowered to the first option, one at a time.
+
+    :param case: Failing case.
+    :param max_runs: Maximum number of games to play while shrinking.
+    :return: Smallest failing case found.
+    """
+    runs = 0
+
+    def attempt(choices: list[int]) -> FuzzCase | None:
+        nonlocal runs
+        runs += 1
+        candidate = run_case(case.seed, case.num_players, case.deck, prefix=choices)
+        return candidate if candidate.signature == case.signature else None
+
+    best = attempt(list(case.choices)) or case
+    chunk_size = max(1, len(best.choices) // 2)
+    while chunk_size >= 1 and runs < max_runs:
+        position, improved = 0, False
+        while position < len(best.choices) and runs < max_runs:
+            candidate = attempt(best.choices[:position] + best.choices[position + chunk_size:])
+            if candidate is not None and len(candidate.choices) < len(best.choices):
+                best, improved = candidate, True
+            else:
+                position += chunk_size
+        if not improved:
+            chunk_size //= 2
+    for position in range(len(best.choices)):
+        if runs >= max_runs:
+            break
+        if best.choices[position] != 0:
+            candidate = attempt(best.choices[:position] + [0] + best.choices[position + 1:])
+            if candidate is not None:
+                best = candidate
+    # Trailing zeros are implied when replaying, so they can be dropped
+    while best.choices and best.choices[-1] == 0:
+        best.choices.pop()
+    return best
+
+
+def fuzz(games: int, player_counts: list[int], decks: list[str], jobs: int, start_seed: int = 0,
+         chunk_size: int = 1000, measure_coverage: bool = True) -> None:
+    started = time.perf_counter()
+    tasks = [(seed, min(seed + chunk_size, start_seed + games), player_counts, decks, measure_coverage)
+             for seed in range(start_seed, start_seed + games, chunk_size)]
+    failures: dict[tuple, FuzzCase] = {}
+    arcs, plays, played = set(), Counter(), 0
+    with multiprocessing.Pool(jobs) as pool:
+        for num_games, chunk_failures, chunk_arcs, chunk_plays in pool.imap_unordered(fuzz_seed_range, tasks):
+            played += num_games
+            arcs |= chunk_arcs
+            plays += chunk_plays
+            for signature, case in chunk_failures.items():
+                if signature not in failures or case.seed < failures[signature].seed:
+                    failures[signature] = case
+    elapsed = time.perf_counter() - started
+    print(f"Played {played} games in {elapsed:.1f}s ({played / elapsed:.0f} games/s), "
+          f"{len(failures)} distinct failure(s)")
+
+    coverage = EffectCoverage()
+    coverage.arcs = arcs
+    if coverage.enabled:
+        print("\nBranch coverage per effect (taken/total) and number of runs (plays and discards):")
+        for name, (taken, total) in coverage.report().items():
+            print(f"  {name:<30} {taken:>3}/{total:<3} {plays[name]:>10}")
+    for signature, case in sorted(failures.items(), key=lambda item: item[1].seed):
+        shrunk = shrink(case)
+        print(f"\n{signature[0]} at {signature[1]} (seed {case.seed}, {len(case.choices)} -> "
+              f"{len(shrunk.choices)} decisions)")
+        print(shrunk.error or case.error, end="")
+        print(f"  Reproduce: {shrunk.replay_command()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Randomized rules fuzzer for Lovecraft Letter")
+    parser.add_argument("--games", type=int, default=10000, help="Number of games to play")
+    parser.add_argument("--players", type=int, nargs="+", default=[2, 3, 4, 5, 6], help="Player counts to use")
+    parser.add_argument("--deck", nargs="+", default=["deck.txt"], help="Deck files to use")
+    parser.add_argument("--jobs", type=int, default=multiprocessing.cpu_count(), help="Number of processes")
+    parser.add_argument("--seed", type=int, default=0, help="First seed (or the seed to replay)")
+    parser.add_argument("--no-coverage", action="store_true", help="Don't measure branch coverage")
+    parser.add_argument("--replay", action="store_true", help="Replay a single case with the game log")
+    parser.add_argument("--choices", default="-", help="Comma-separated decisions to replay")
+    arguments = parser.parse_args()
+
+    if arguments.replay:
+        choices = [] if arguments.choices == "-" else [int(choice) for choice in arguments.choices.split(",")]
+        case = run_case(arguments.seed, arguments.players[0], arguments.deck[0], prefix=choices)
+        for event in case.events:
+            print(event)
+        print(case.error or "No failure")
+        return
+    fuzz(arguments.games, arguments.players, arguments.deck, arguments.jobs, arguments.seed,
+         measure_coverage=not arguments.no_coverage)
+
+
+if __name__ == '__main__':
+    main()
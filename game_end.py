@@ -1,10 +1,12 @@
 class RoundEndException(Exception):
-    def __init__(self, winner):
+    def __init__(self, winner, reason: str | None = None):
         self.winner = winner
-        super().__init__(f"Round is over. Winner: {winner.name}")
+        self.reason = reason
+        super().__init__(f"Round is over. Winner: {winner.name if winner is not None else 'none (draw)'}")
 
 
 class GameOverException(Exception):
-    def __init__(self, winner):
+    def __init__(self, winner, reason: str | None = None):
         self.winner = winner
+        self.reason = reason
         super().__init__(f"Game is over. Winner: {winner.name}")
@@ -1,15 +1,57 @@
 import random
 import time
 from collections import defaultdict
-from typing import Callable
+from contextlib import nullcontext
+from functools import partial
+from typing import Callable, NamedTuple
 
 from colorama import Fore
+from agent import Agent
 from card import Card, CARD_NAMES
+from console import quiet
 from effect import Effect
 from game_end import RoundEndException, GameOverException
 from player import Player
 
 
+class GameEvent(NamedTuple):
+    """
+    Compact record of something that happened during a game. Players are referenced by their index in
+    `Gamestate.players` (-1 if there is none), cards by their code.
+    """
+    round_number: int
+    turn_number: int
+    kind: str
+    player: int = -1
+    card: str = ""
+    target: int = -1
+    detail: str = ""
+
+
+def load_deck(path: str = "deck.txt") -> dict[str, int]:
+    """
+    Reads a deck file, which contains one line per card in the format `<amount> <card_code>`.
+    Empty lines, comments and unknown card codes are ignored.
+
+    :param path: Path of the deck file.
+    :return: Amount of cards in the deck per card code.
+    """
+    with open(path) as f:
+        deck_cards = [tuple(line.strip().split(maxsplit=1)) for line in f.readlines()
+                      if not line.strip().startswith("#") and line.strip()]
+    return {code: int(n) for n, code in deck_cards if code in CARD_NAMES.keys()}
+
+
+def format_deck(deck: dict[str, int]) -> str:
+    """
+    Formats a deck composition as the content of a deck file, which can be read by `load_deck`.
+
+    :param deck: Amount of cards in the deck per card code.
+    :return: Content of the deck file.
+    """
+    return "# amount card_code\n" + "\n".join(f"{n} {code}" for code, n in deck.items()) + "\n"
+
+
 class Gamestate:
     deck: list[Card]
     banished_cards: list[Card]
@@ -21,6 +63,15 @@ class Gamestate:
     hands: dict[Player, list[Card]]
     discard_pile: dict[Player, list[Card]]
     scores: dict[Player, tuple[int, int]]
+    events: list[GameEvent]
+    round_number: int
+    turn_number: int
+    winner: Player | None
+    deck_composition: dict[str, int]
+    agents: dict[Player, Agent]
+    headless: bool
+    rng: random.Random
+    after_turn_hooks: list[Callable[["Gamestate"], None]]
 
     @property
     def players_in_game(self) -> list[Player]:
@@ -30,29 +81,89 @@ class Gamestate:
     @property
     def players_mad(self) -> set[Player]:
         """ All players who have at least one madness card in their discard pile. """
-        madness_status = {
-            player: any(card.effect_madness is not None for card in self.discard_pile.get(player, []))
-            for player in self.players
-        }
-        return {player for player, is_mad in madness_status.items() if is_mad}
+        return {player for player, discard_pile in self.discard_pile.items()
+                if any(card.effect_madness is not None for card in discard_pile)}
 
-    def __init__(self, player_names_or_num: list[str] | int = 2):
+    def __init__(self, player_names_or_num: list[str] | int = 2, deck: str | dict[str, int] = "deck.txt",
+                 agents: list[Agent | None] | None = None, seed: int | None = None, headless: bool = False):
+        """
+        :param player_names_or_num: Number of players or a list of player names.
+        :param deck: Path of the deck file to play with or the amount of cards per card code (see `load_deck`).
+        :param agents: CPU agents making the decisions for the players, in the order of the players.
+            Players without agent (`None`) are prompted via `input()`. Default is no CPU players at all.
+        :param seed: Seed for shuffling the deck. Games with the same seed, deck, players and decisions are identical.
+        :param headless: If True, the game doesn't print anything and doesn't pause between turns.
+        """
         if isinstance(player_names_or_num, int) and player_names_or_num >= 2:
             self.players = [Player(f"Player {i + 1}") for i in range(player_names_or_num)]
         elif isinstance(player_names_or_num, list) and all(isinstance(name, str) for name in player_names_or_num):
             self.players = [Player(name) for name in player_names_or_num]
         else:
             raise ValueError("Invalid player names or number of players")
+        self.deck_composition = load_deck(deck) if isinstance(deck, str) else dict(deck)
+        if agents is not None and len(agents) != len(self.players):
+            raise ValueError("Number of agents must match the number of players")
+        self.agents = {player: agent for player, agent in zip(self.players, agents or []) if agent is not None}
+        self.rng = random.Random(seed)
+        self.headless = headless
+        self.after_turn_hooks = []
         self.scores = {player: (0, 0) for player in self.players}
+        self.events = []
+        self.round_number = 0
+        self.turn_number = 0
+        self.winner = None
+
+    def emit(self, kind: str, player: Player | None = None, card: Card | None = None,
+             target: Player | None = None, detail: str = "") -> None:
+        """
+        Appends a `GameEvent` to the event log of this game.
+
+        :param kind: Type of event, e.g. "draw", "play", "discard", "eliminate", "mad", "round_end" or "game_end".
+        :param player: Player the event is about. Default is None.
+        :param card: Card involved in the event. Default is None.
+        :param target: Second player involved in the event, e.g. the killer of an eliminated player. Default is None.
+        :param detail: Additional information, e.g. the effect function that was played or the reason a round ended.
+        """
+        self.events.append(GameEvent(self.round_number, self.turn_number, kind,
+                                     self.players.index(player) if player is not None else -1,
+                                     card.code if card is not None else "",
+                                     self.players.index(target) if target is not None else -1,
+                                     detail))
+
+    def clone(self, copy_events: bool = False) -> "Gamestate":
+        """
+        Creates an independent copy of this gamestate, e.g. for agents that search by playing ahead.
+        Cards and players are immutable and shared between both copies, only the containers holding them are copied.
+
+        :param copy_events: Whether the copy gets the event log so far. Otherwise, its event log starts empty.
+        :return: Copy of this gamestate.
+        """
+        clone = object.__new__(Gamestate)
+        clone.__dict__.update(self.__dict__)
+        clone.events = list(self.events) if copy_events else []
+        clone.scores = dict(self.scores)
+        clone.agents = dict(self.agents)
+        clone.after_turn_hooks = list(self.after_turn_hooks)
+        clone.rng = random.Random()
+        clone.rng.setstate(self.rng.getstate())
+        if hasattr(self, "deck"):
+            clone.deck = list(self.deck)
+            clone.banished_cards = list(self.banished_cards)
+            clone.players_out = set(self.players_out)
+            clone.players_protected = set(self.players_protected)
+            clone.on_player_turn_start = defaultdict(list, {player: list(hooks) for player, hooks
+                                                            in self.on_player_turn_start.items()})
+            clone.hands = {player: list(hand) for player, hand in self.hands.items()}
+            clone.discard_pile = {player: list(discard_pile) for player, discard_pile in self.discard_pile.items()}
+        return clone
 
     def initialize_round(self) -> None:
         """
         Resets the field to start a new round. This must be called after `__init__()` before calling `start_game()`.
         """
-        with open("deck.txt") as f:
-            deck_cards = [tuple(line.strip().split(maxsplit=1)) for line in f.readlines()
-                          if not line.strip().startswith("#") and line.strip()]
-        self.deck = sum(([Card(code)] * int(n) for n, code in deck_cards if code in CARD_NAMES.keys()), [])
+        self.deck = [Card.by_code(code) for code, n in self.deck_composition.items() for _ in range(n)]
+        self.round_number += 1
+        self.turn_number = 0
         self.shuffle_deck()
         self.banished_cards = []
         # If the game is played with 2 players, banish 5 cards from the deck face-up
@@ -70,32 +181,48 @@ class Gamestate:
         for player in self.players:
             self.draw_card(player)
 
-    def start_game(self) -> None:
+    def start_game(self, resume_round: bool = False) -> None:
         """
         Start the game and repeatedly start new rounds until a player wins the game.
-        """
-        try:
-            while True:
-                self._start_round()
-        except GameOverException as goe:
-            print(f"{Fore.CYAN}GAME OVER - Winner: {Fore.RESET}{goe.winner.name}")
-        except KeyboardInterrupt:
-            print(f"{Fore.CYAN}Game ended by KeyboardInterrupt{Fore.RESET}")
 
-    def _start_round(self) -> None:
+        :param resume_round: If True, the first round continues from the current state instead of being initialized,
+            e.g. for gamestates built from a scenario. Default is False.
+        """
+        with quiet() if self.headless else nullcontext():
+            try:
+                initialize = not resume_round
+                while True:
+                    self._start_round(initialize)
+                    initialize = True
+            except GameOverException as goe:
+                self.winner = goe.winner
+                self.emit("game_end", goe.winner, detail=goe.reason or "")
+                print(f"{Fore.CYAN}GAME OVER - Winner: {Fore.RESET}{goe.winner.name}")
+            except KeyboardInterrupt:
+                print(f"{Fore.CYAN}Game ended by KeyboardInterrupt{Fore.RESET}")
+
+    def _start_round(self, initialize: bool = True) -> None:
         """
         Initializes a new round, thus resetting the field and repeatedly processes turns until the round ends.
+
+        :param initialize: Whether to initialize the round. Otherwise, the round continues from the current state.
         """
-        self.initialize_round()
+        if initialize:
+            self.initialize_round()
         try:
             while True:
                 self.process_turn()
+        except GameOverException as goe:
+            # Some effects end the whole game immediately, which also ends the current round
+            self.emit_round_end(goe.winner, goe.reason)
+            raise
         except RoundEndException as ree:
+            self.emit_round_end(ree.winner, ree.reason)
             if ree.winner is None:
                 print(f"{Fore.CYAN}Round is a Draw!{Fore.RESET}")
             else:
                 print(f"{Fore.CYAN}Round is over. Winner: {Fore.YELLOW}{ree.winner.name}{Fore.RESET}")
-                time.sleep(3)
+                self.pause(3)
                 sanity_score, madness_score = self.scores[ree.winner]
                 if ree.winner in self.players_mad:
                     print(f"1 Point was added to their {Fore.GREEN}INSANITY{Fore.RESET} score!")
@@ -103,9 +230,11 @@ class Gamestate:
                 else:
                     print(f"1 Point was added to their {Fore.YELLOW}SANITY{Fore.RESET} score!")
                     sanity_score += 1
-                if sanity_score >= 2 or madness_score >= 3:
-                    raise GameOverException(ree.winner)
                 self.scores[ree.winner] = sanity_score, madness_score
+                if sanity_score >= 2:
+                    raise GameOverException(ree.winner, "sanity_score")
+                if madness_score >= 3:
+                    raise GameOverException(ree.winner, "madness_score")
         print()
         for player, score in self.scores.items():
             print(f"{Fore.CYAN}{player.name}{Fore.RESET} |\t"
@@ -113,33 +242,57 @@ class Gamestate:
                   f"{Fore.GREEN}INSANITY{Fore.RESET}: {score[1]}/3")
         print()
         print()
-        time.sleep(3)
+        self.pause(3)
+
+    def pause(self, seconds: float) -> None:
+        """ Gives human players some time to follow the game log. Headless games don't pause at all. """
+        if not self.headless:
+            time.sleep(seconds)
+
+    def emit_round_end(self, winner: Player | None, reason: str | None) -> None:
+        """
+        Records the end of the current round in the event log. Every player who is mad at this point gets a "mad"
+        event, before the "round_end" event itself is recorded.
+
+        :param winner: Winner of the round or None, if the round is a draw.
+        :param reason: Reason the round ended, see `RoundEndException.reason`.
+        """
+        players_mad = self.players_mad
+        for player in self.players:
+            if player in players_mad:
+                self.emit("mad", player)
+        self.emit("round_end", winner, detail=reason or "")
 
     def shuffle_deck(self) -> None:
         print(f"{Fore.CYAN}Shuffling deck...{Fore.RESET}")
-        random.shuffle(self.deck)
+        self.rng.shuffle(self.deck)
 
     def process_turn(self) -> None:
         """
         Core logic of the game. Processes the turn of the current player and performs all necessary steps.
         Logic in this function should be minimal, as all changes to the `Gamestate` should be done via functions.
         """
-        time.sleep(2)
+        self.pause(2)
         print()
         print(f">> {Fore.YELLOW}{self.turn_player.name}'s turn{Fore.RESET}")
+        self.turn_number += 1
 
         self.process_turn_start_hooks(self.turn_player)
         self.insanity_check(self.turn_player)
-        self.draw_card(self.turn_player)
+        # Players who succumbed to the Void during their insanity check don't get to play
+        if self.turn_player not in self.players_out:
+            self.draw_card(self.turn_player)
 
-        # Print all available cards for convenience
-        self.print_state(self.turn_player)
+            # Print all available cards for convenience
+            self.print_state(self.turn_player)
 
-        # Make the player select a card and effect to activate
-        self.play_card_effect(self.turn_player)
+            # Make the player select a card and effect to activate
+            self.play_card_effect(self.turn_player)
 
         # Pass to next player
         self.turn_player = self.next_player()
+        for hook in self.after_turn_hooks:
+            hook(self)
 
     def next_player(self) -> Player:
         """
@@ -162,7 +315,7 @@ class Gamestate:
         if len(players_in_game) == 1:
             last_player = players_in_game[0]
             print(f"{Fore.YELLOW}{last_player.name} {Fore.CYAN}is the last survivor!{Fore.RESET}")
-            raise RoundEndException(last_player)
+            raise RoundEndException(last_player, "last_survivor")
 
     def deck_out_of_cards(self) -> None:
         """
@@ -172,10 +325,11 @@ class Gamestate:
         and the next-highest card is considered in the same fashion.
         """
         print(f"{Fore.CYAN}Deck out of cards, winner is determined by card value.{Fore.RESET}")
-        players_in_game = {player: hand[0].value for player, hand in self.hands.items()
+        # A player might have no hand card at all, if they had to discard it and couldn't draw a new one
+        players_in_game = {player: max((card.value for card in hand), default=0) for player, hand in self.hands.items()
                            if player not in self.players_out}
-        for player, hand in players_in_game:
-            print(f"{player.name}'s value: {hand[0].value}")
+        for player, value in players_in_game.items():
+            print(f"{player.name}'s value: {value}")
 
         # Determine Winner by finding the highest value, which is not present multiple times among the players
         highest_value = max(players_in_game.values())
@@ -184,12 +338,12 @@ class Gamestate:
                                if value != highest_value}
             if len(players_in_game) == 0:
                 print(f"{Fore.CYAN}Game is a Draw!{Fore.RESET}")
-                raise RoundEndException(None)
+                raise RoundEndException(None, "deck_out")
             else:
                 highest_value = max(players_in_game.values())
         winner = next(player for player, value in players_in_game.items() if value == highest_value)
         print(f"{Fore.CYAN}Winner is {Fore.RESET}{winner.name}")
-        raise RoundEndException(winner)
+        raise RoundEndException(winner, "deck_out")
 
     def print_state(self, player: Player) -> None:
         """
@@ -223,6 +377,7 @@ class Gamestate:
         if len(self.deck) == 0:
             self.deck_out_of_cards()
         card = self.deck.pop()
+        self.emit("draw", player, card)
         if append_to_hand:
             self.hands[player].append(card)
         return card
@@ -242,6 +397,7 @@ class Gamestate:
               f"\"{Fore.RESET}[{discard_card.value}] {discard_card.name}\"{Fore.RESET}")
         self.hands[discarding_player].remove(discard_card)
         self.discard_pile[discarding_player].append(discard_card)
+        self.emit("discard", discarding_player, discard_card)
         if discard_card.effect_on_discard is not None:
             discard_card.effect_on_discard.effect(self, discarding_player)
 
@@ -260,6 +416,7 @@ class Gamestate:
               f"\"{Fore.RESET}[{card_to_play.value}] {card_to_play.name}\""
               f" {Fore.GREEN}(MADNESS){Fore.RESET}" if effect_to_activate.is_madness else "")
         self.hands[activating_player].remove(card_to_play)
+        self.emit("play", activating_player, card_to_play, detail=effect_to_activate.effect.__name__)
         effect_to_activate.effect(self, activating_player)
         self.discard_pile[activating_player].append(card_to_play)
 
@@ -285,20 +442,26 @@ class Gamestate:
         self.discard_pile[eliminated_player].extend(self.hands[eliminated_player])
         self.hands[eliminated_player].clear()
         self.players_out.add(eliminated_player)
+        self.emit("eliminate", eliminated_player, target=killer_player)
         self.check_win_condition()
         return True
 
-    def select_card_from(self, cards: list[Card]) -> Card:
+    def select_card_from(self, cards: list[Card], deciding_player: Player | None = None) -> Card:
         """
         Prompts the user to select a card from a list of cards. Does not execute any effects or actions.
 
         :param cards: Cards to chose from.
+        :param deciding_player: Player who selects the card. Default is the `turn_player`.
         :return: Chosen card.
         """
         if len(cards) == 0:
             raise ValueError("No cards to select from")
         if len(cards) == 1:
             return cards[0]
+        if deciding_player is None:
+            deciding_player = self.turn_player
+        if deciding_player in self.agents:
+            return self.agents[deciding_player].select_card(self, deciding_player, cards)
 
         for i, card in enumerate(cards, start=1):
             print(f"{i} | {card.name}")
@@ -343,14 +506,18 @@ class Gamestate:
         else:
             effects_available = {effect: True for effect in effects}
 
-        num_available_effects = len([e for e, can_activate in effects_available.items() if can_activate])
-        if num_available_effects == 0:
+        available_effects = [effect for effect in effects if effects_available[effect]]
+        if len(available_effects) == 0:
             raise ValueError("No effects available to select from. This should not happen!")
-        if num_available_effects == 1 and auto_return:
-            return effects[0]
+        if len(available_effects) == 1 and auto_return:
+            return available_effects[0]
 
         # Sort effects, so effects of the same card are grouped together - also, the madness effect should be last
         effects.sort(key=lambda e: (e.card.name, e.is_madness))
+        if activating_player in self.agents:
+            available_effects = [effect for effect in effects if effects_available[effect]]
+            return self.agents[activating_player].select_effect(self, activating_player, available_effects)
+
         for i, effect in enumerate(effects, start=1):
             # Effect can be used
             if effects_available[effect]:
@@ -393,7 +560,8 @@ class Gamestate:
             deciding_player = activating_player
 
         if apply_default_target_filter:
-            possible_targets = list(set(self.players_in_game) - self.players_protected - {activating_player})
+            possible_targets = [player for player in self.players_in_game
+                                if player not in self.players_protected and player != activating_player]
         else:
             possible_targets = self.players
 
@@ -407,6 +575,8 @@ class Gamestate:
                 return activating_player
             print(f"{Fore.CYAN}No valid unprotected targets available.{Fore.RESET}")
             return None
+        if deciding_player in self.agents:
+            return self.agents[deciding_player].select_target(self, deciding_player, possible_targets)
 
         for i, player in enumerate(possible_targets, start=1):
             print(f"{i} | {player.name}")
@@ -428,6 +598,8 @@ class Gamestate:
         :return: Selected integer value.
         """
         print(f"{Fore.CYAN}{deciding_player.name} selects a card value ...{Fore.RESET}")
+        if deciding_player in self.agents:
+            return self.agents[deciding_player].select_value(self, deciding_player, start, end)
         selection = None
         while selection is None or selection not in range(start, end + 1):
             try:
@@ -459,7 +631,7 @@ class Gamestate:
             print(f"{Fore.YELLOW}{target_player.name} "
                   f"{Fore.CYAN}is now protected until the start of their next turn!{Fore.RESET}")
             self.schedule_on_player_turn_start(target_player,
-                                               lambda game: game.unprotect_player(target_player))
+                                               partial(Gamestate.unprotect_player, player=target_player))
         self.players_protected.add(target_player)
 
     def unprotect_player(self, player: Player) -> None:
@@ -483,6 +655,7 @@ class Gamestate:
                   f"{madness_cards} draw{'s' if madness_cards > 1 else ''} ...{Fore.RESET}")
             for i in range(madness_cards):
                 drawn_card = self.draw_card(player, append_to_hand=False)
+                self.discard_pile[player].append(drawn_card)
                 if drawn_card.effect_madness is not None:
                     print(f"{Fore.YELLOW}{player.name}{Fore.RED} succumbed {Fore.GREEN}to the whispers of the Void,"
                           f"when facing '{drawn_card.name}'!{Fore.RESET}")
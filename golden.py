@@ -0,0 +1,223 @@
+"""
+Differential golden-game harness. Plays the same seeded games with the same decision scripts through a reference
+engine and a candidate engine, compares their event logs, final scores and failures, and reports the first divergence
+of every diverging game with context, together with the relative throughput of both engines.
+
+Engines are factories `factory(num_players, deck, agents, seed) -> Gamestate` returning a headless game which is
+played with `start_game()`, see `simulation.Engine`. Built-in engines are listed in `ENGINES`, any other engine is
+given as `module:callable`.
+Decisions come from the same `fuzz.ChoiceStream` per seed as in the fuzzer.
+
+Usage:
+    python golden.py --games 5000 --candidate compact
+    python golden.py --games 1000 --players 4 --candidate my_engine:create_game --jobs 8
+"""
+import argparse
+import multiprocessing
+import random
+import sys
+import time
+import traceback
+from dataclasses import dataclass, field
+
+from compact import CompactState
+from fuzz import ChoiceStream, FuzzAgent, case_parameters
+from gamestate import Gamestate, GameEvent
+from simulation import Engine, reference_engine, resolve_engine as resolve_module_engine
+
+# Number of events shown before and after the first diverging event
+CONTEXT_EVENTS = 3
+
+
+def _round_trip_compact(gamestate: Gamestate) -> None:
+    CompactState.from_gamestate(gamestate).restore(gamestate)
+
+
+def compact_engine(num_players: int, deck: str, agents: list, seed: int) -> Gamestate:
+    """ Reference engine whose whole round state is replaced by a round trip through a `CompactState` every turn. """
+    gamestate = reference_engine(num_players, deck, agents, seed)
+    gamestate.after_turn_hooks.append(_round_trip_compact)
+    return gamestate
+
+
+def _round_trip_clone(gamestate: Gamestate) -> None:
+    clone = gamestate.clone()
+    # The clone is played on in place of the original, so all containers of the game are the clone's from now on
+    for name in ("deck", "banished_cards", "players_out", "players_protected", "on_player_turn_start", "hands",
+                 "discard_pile", "scores", "rng"):
+        setattr(gamestate, name, getattr(clone, name))
+
+
+def clone_engine(num_players: int, deck: str, agents: list, seed: int) -> Gamestate:
+    """ Reference engine which continues from a `Gamestate.clone()` after every turn. """
+    gamestate = reference_engine(num_players, deck, agents, seed)
+    gamestate.after_turn_hooks.append(_round_trip_clone)
+    return gamestate
+
+
+ENGINES: dict[str, Engine] = {
+    "reference": reference_engine,
+    "compact": compact_engine,
+    "clone": clone_engine,
+}
+
+
+def resolve_engine(name: str) -> Engine:
+    """ :return: Built-in engine `name` or the callable `name` refers to as `module:callable`. """
+    if name in ENGINES:
+        return ENGINES[name]
+    if ":" not in name:
+        raise ValueError(f"Unknown engine {name!r}, expected one of {', '.join(ENGINES)} or module:callable")
+    return resolve_module_engine(name)
+
+
+@dataclass
+class GameResult:
+    events: list[GameEvent]
+    scores: list[tuple[int, int]]
+    choices: list[int]
+    error: str | None
+    seconds: float
+
+
+def play(engine: Engine, seed: int, num_players: int, deck: str) -> GameResult:
+    """ Plays one game with the decisions of the fuzzer for `seed`. Exceptions of the engine are part of the result. """
+    stream = ChoiceStream((), random.Random(f"choices-{seed}"))
+    started = time.perf_counter()
+    gamestate = engine(num_players, deck, [FuzzAgent(stream)] * num_players, seed)
+    error = None
+    try:
+        gamestate.start_game()
+    except Exception as e:
+        error = "".join(traceback.format_exception_only(e)).strip()
+    seconds = time.perf_counter() - started
+    return GameResult(gamestate.events, [gamestate.scores[player] for player in gamestate.players], stream.choices,
+                      error, seconds)
+
+
+@dataclass
+class Divergence:
+    seed: int
+    num_players: int
+    deck: str
+    # What diverged first: "events", "scores", "error" or "choices"
+    kind: str
+    # Index of the first diverging event, if the event logs diverge
+    index: int = -1
+    context: list[str] = field(default_factory=list)
+
+    def replay_command(self, reference: str, candidate: str) -> str:
+        return (f"python golden.py --games 1 --seed {self.seed} --players {self.num_players} --deck {self.deck} "
+                f"--reference {reference} --candidate {candidate} --jobs 1")
+
+
+def _event_context(reference: list[GameEvent], candidate: list[GameEvent], index: int) -> list[str]:
+    lines = []
+    for i in range(max(index - CONTEXT_EVENTS, 0), index + CONTEXT_EVENTS + 1):
+        expected = reference[i] if i < len(reference) else None
+        actual = candidate[i] if i < len(candidate) else None
+        if expected is None and actual is None:
+            break
+        if expected == actual:
+            lines.append(f"    {i:>5}   {expected}")
+        else:
+            lines.append(f"  - {i:>5}   {expected if expected is not None else '(no event)'}")
+            lines.append(f"  + {i:>5}   {actual if actual is not None else '(no event)'}")
+    return lines
+
+
+def compare(reference: GameResult, candidate: GameResult, seed: int, num_players: int,
+            deck: str) -> Divergence | None:
+    """ :return: The first difference between two plays of the same game, or None if they are identical. """
+    if reference.events != candidate.events:
+        index = next((i for i, (expected, actual) in enumerate(zip(reference.events, candidate.events))
+                      if expected != actual), min(len(reference.events), len(candidate.events)))
+        return Divergence(seed, num_players, deck, "events", index,
+                          _event_context(reference.events, candidate.events, index))
+    for kind, expected, actual in (("scores", reference.scores, candidate.scores),
+                                   ("error", reference.error, candidate.error),
+                                   ("choices", reference.choices, candidate.choices)):
+        if expected != actual:
+            return Divergence(seed, num_players, deck, kind, context=[f"  - {expected}", f"  + {actual}"])
+    return None
+
+
+def compare_seed_range(arguments: tuple[int, int, str, str, list[int], list[str]]
+                       ) -> tuple[int, float, float, list[Divergence]]:
+    """
+    Plays all seeds in `[start, end)` with both engines. Used as a worker function for multiprocessing.
+
+    :return: Number of games, seconds spent in the reference and the candidate engine and all divergences.
+    """
+    start, end, reference_name, candidate_name, player_counts, decks = arguments
+    reference, candidate = resolve_engine(reference_name), resolve_engine(candidate_name)
+    reference_seconds, candidate_seconds, divergences = 0.0, 0.0, []
+    for seed in range(start, end):
+        num_players, deck = case_parameters(seed, player_counts, decks)
+        # Alternate which engine plays first, so neither profits from warm caches more than the other
+        if seed % 2 == 0:
+            expected = play(reference, seed, num_players, deck)
+            actual = play(candidate, seed, num_players, deck)
+        else:
+            actual = play(candidate, seed, num_players, deck)
+            expected = play(reference, seed, num_players, deck)
+        reference_seconds += expected.seconds
+        candidate_seconds += actual.seconds
+        divergence = compare(expected, actual, seed, num_players, deck)
+        if divergence is not None:
+            divergences.append(divergence)
+    return end - start, reference_seconds, candidate_seconds, divergences
+
+
+def golden(games: int, reference: str, candidate: str, player_counts: list[int], decks: list[str], jobs: int,
+           start_seed: int = 0, chunk_size: int = 250, show: int = 3) -> bool:
+    """
+    Compares two engines on `games` seeded games and prints the report.
+
+    :return: True if all games were identical.
+    """
+    tasks = [(seed, min(seed + chunk_size, start_seed + games), reference, candidate, player_counts, decks)
+             for seed in range(start_seed, start_seed + games, chunk_size)]
+    played, reference_seconds, candidate_seconds, divergences = 0, 0.0, 0.0, []
+    with multiprocessing.Pool(jobs) as pool:
+        for chunk in pool.imap_unordered(compare_seed_range, tasks):
+            played += chunk[0]
+            reference_seconds += chunk[1]
+            candidate_seconds += chunk[2]
+            divergences.extend(chunk[3])
+
+    print(f"{reference}: {played / reference_seconds:.0f} games/s, {candidate}: {played / candidate_seconds:.0f} "
+          f"games/s ({reference_seconds / candidate_seconds:.2f}x throughput of {reference})")
+    if len(divergences) == 0:
+        print(f"All {played} games identical (events, scores, errors and decisions)")
+        return True
+    print(f"{len(divergences)} of {played} games diverge")
+    for divergence in sorted(divergences, key=lambda d: d.seed)[:show]:
+        where = f" at event {divergence.index}" if divergence.kind == "events" else ""
+        print(f"\nSeed {divergence.seed} ({divergence.num_players} players, {divergence.deck}): "
+              f"{divergence.kind} diverge{where} ({reference} -, {candidate} +)")
+        for line in divergence.context:
+            print(line)
+        print(f"  Reproduce: {divergence.replay_command(reference, candidate)}")
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two engine implementations on the same seeded games")
+    parser.add_argument("--games", type=int, default=2000, help="Number of games to play with each engine")
+    parser.add_argument("--reference", default="reference", help="Reference engine (name or module:callable)")
+    parser.add_argument("--candidate", default="compact", help="Candidate engine (name or module:callable)")
+    parser.add_argument("--players", type=int, nargs="+", default=[2, 3, 4, 5, 6], help="Player counts to use")
+    parser.add_argument("--deck", nargs="+", default=["deck.txt"], help="Deck files to use")
+    parser.add_argument("--jobs", type=int, default=multiprocessing.cpu_count(), help="Number of processes")
+    parser.add_argument("--seed", type=int, default=0, help="First seed")
+    parser.add_argument("--show", type=int, default=3, help="Number of diverging games to show")
+    arguments = parser.parse_args()
+
+    identical = golden(arguments.games, arguments.reference, arguments.candidate, arguments.players, arguments.deck,
+                       arguments.jobs, arguments.seed, show=arguments.show)
+    sys.exit(0 if identical else 1)
+
+
+if __name__ == '__main__':
+    main()
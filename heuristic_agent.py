@@ -0,0 +1,156 @@
+import random
+from dataclasses import astuple, dataclass, fields
+from typing import Sequence
+
+from agent import Agent
+from card import Card
+from effect import (Effect, card0_effect, card1_effect, card3_effect, card4_effect, card7_madness_effect,
+                    card8_effect, card8_madness_effect)
+from player import Player
+
+
+@dataclass
+class HeuristicParams:
+    """
+    Parameter vector of a `HeuristicAgent`. Use `to_vector` and `from_vector` to tune agents with generic optimizers.
+    """
+    # Play the protection of the Elder Sign (`card4_effect`), when the other hand card has at least this value
+    protect_threshold: float = 5.0
+    # Preference for comparing hands (`card3_effect`) per point the other hand card is above average
+    compare_weight: float = 1.0
+    # Preference for accusing (`card1_effect`) per expected elimination probability
+    guess_weight: float = 8.0
+    # Preference for playing madness cards while holding Cthulhu, to get closer to summoning it.
+    # Negative values avoid going mad at all.
+    madness_drive: float = 3.0
+    # Preference for targeting the player with the highest score over other players
+    aggression: float = 1.0
+    # Probability of taking a random decision instead
+    randomness: float = 0.0
+
+    def to_vector(self) -> tuple[float, ...]:
+        return astuple(self)
+
+    @classmethod
+    def from_vector(cls, vector: Sequence[float]) -> "HeuristicParams":
+        if len(vector) != len(fields(cls)):
+            raise ValueError(f"Expected {len(fields(cls))} parameters, got {len(vector)}")
+        return cls(*vector)
+
+
+# Score of effects that must never be played voluntarily or that win immediately
+FORBIDDEN = -1000.0
+WINNING = 1000.0
+
+
+class HeuristicAgent(Agent):
+    """
+    Rule-based agent, which decides in microseconds without any search. Used as the default opponent for
+    simulations and as the baseline for stronger agents.
+
+    Every available effect gets a score from a few hand-written rules and the highest score is played.
+    Card values are guessed from the cards that haven't been seen yet.
+    """
+
+    def __init__(self, params: HeuristicParams | Sequence[float] | None = None, seed: int | None = None):
+        if params is None:
+            params = HeuristicParams()
+        elif not isinstance(params, HeuristicParams):
+            params = HeuristicParams.from_vector(params)
+        self.params = params
+        self.rng = random.Random(seed)
+        # Number of cards per value of the last deck composition seen, which rarely changes
+        self._deck_values: tuple[dict | None, list[int]] = (None, [])
+
+    def select_effect(self, gamestate: "Gamestate", player: Player, effects: list[Effect]) -> Effect:
+        if self.params.randomness > 0 and self.rng.random() < self.params.randomness:
+            return self.rng.choice(effects)
+        return max(effects, key=lambda effect: self.score_effect(gamestate, player, effect) + self.rng.random() * 1e-3)
+
+    def score_effect(self, gamestate: "Gamestate", player: Player, effect: Effect) -> float:
+        """
+        Scores an effect for `player`, the effect with the highest score is played.
+
+        :param gamestate: Current gamestate.
+        :param player: Player who would play the effect.
+        :param effect: Available effect.
+        :return: Score of the effect.
+        """
+        hand = gamestate.hands[player]
+        # Cards are shared instances, so only the played position is removed and a copy of the card stays
+        position = next((i for i, card in enumerate(hand) if card is effect.card), None)
+        other_cards = hand[:position] + hand[position + 1:] if position is not None else hand
+        other_value = max((card.value for card in other_cards), default=0)
+
+        function = effect.effect
+        if function is card7_madness_effect and other_value >= 5:
+            return WINNING
+        if function is card8_madness_effect:
+            madness_cards = sum(1 for card in gamestate.discard_pile[player] if card.effect_madness is not None)
+            return WINNING if madness_cards >= 2 else FORBIDDEN
+        if function is card8_effect or function is card0_effect:
+            return FORBIDDEN
+
+        # By default, play the lower card and keep the higher one
+        score = -float(effect.card.value)
+        if function is card4_effect and other_value >= self.params.protect_threshold:
+            score += 10.0
+        elif function is card3_effect:
+            score += (other_value - 4.5) * self.params.compare_weight
+        elif function is card1_effect:
+            _, probability = self.most_likely_value(gamestate, player, start=2)
+            score += probability * self.params.guess_weight
+
+        if effect.card.effect_madness is not None:
+            holds_cthulhu = any(card.effect_madness is not None and card.value == 8 for card in other_cards)
+            score += self.params.madness_drive if holds_cthulhu else -abs(self.params.madness_drive) / 2
+        return score
+
+    def select_target(self, gamestate: "Gamestate", player: Player, targets: list[Player]) -> Player:
+        if self.params.randomness > 0 and self.rng.random() < self.params.randomness:
+            return self.rng.choice(targets)
+        return max(targets, key=lambda target: self.params.aggression * sum(gamestate.scores[target])
+                   + self.rng.random())
+
+    def select_card(self, gamestate: "Gamestate", player: Player, cards: list[Card]) -> Card:
+        # Cards are only selected to be handed to other players, so the weakest card is given away first
+        return min(cards, key=lambda card: (card.value, self.rng.random()))
+
+    def select_value(self, gamestate: "Gamestate", player: Player, start: int, end: int) -> int:
+        if self.params.randomness > 0 and self.rng.random() < self.params.randomness:
+            return self.rng.randint(start, end)
+        value, _ = self.most_likely_value(gamestate, player, start, end)
+        return value
+
+    def unseen_values(self, gamestate: "Gamestate", player: Player) -> list[int]:
+        """
+        Counts the values of all cards `player` hasn't seen yet, i.e. cards in the deck and in other players' hands.
+        Cards in hand, on any discard pile and banished cards are known to everyone (or to `player` at least).
+
+        :return: Number of unseen cards per value, indexed by value.
+        """
+        if self._deck_values[0] is not gamestate.deck_composition:
+            deck_values = [0] * 9
+            for code, n in gamestate.deck_composition.items():
+                deck_values[Card.value_by_code(code)] += n
+            self._deck_values = gamestate.deck_composition, deck_values
+        unseen = self._deck_values[1].copy()
+        for card in gamestate.hands[player]:
+            unseen[card.value] -= 1
+        for card in gamestate.banished_cards:
+            unseen[card.value] -= 1
+        for discard_pile in gamestate.discard_pile.values():
+            for card in discard_pile:
+                unseen[card.value] -= 1
+        return unseen
+
+    def most_likely_value(self, gamestate: "Gamestate", player: Player, start: int = 1, end: int = 8
+                          ) -> tuple[int, float]:
+        """
+        :return: Most likely value of an unseen card between `start` and `end` and its probability.
+            Ties are broken in favor of higher values, since those cards are more dangerous.
+        """
+        unseen = self.unseen_values(gamestate, player)
+        total = sum(n for n in unseen if n > 0)
+        value = max(range(start, end + 1), key=lambda v: (unseen[v], v))
+        return value, (max(unseen[value], 0) / total if total > 0 else 0.0)
@@ -1,9 +1,27 @@
+import argparse
+
+import archive
 import gamestate
+from pondering import PonderingGamestate
+from search_agent import MonteCarloAgent
 
 
 def main():
-    game = gamestate.Gamestate()
+    parser = argparse.ArgumentParser(description="Play a game of Lovecraft Letter")
+    parser.add_argument("--cpu", type=int, default=0, help="Number of CPU players, seated after the human player")
+    parser.add_argument("--rollouts", type=int, default=32, help="Rollouts per option of the CPU players")
+    parser.add_argument("--no-ponder", action="store_true",
+                        help="Don't let CPU players think ahead while the human player decides")
+    arguments = parser.parse_args()
+
+    if arguments.cpu > 0:
+        agents = [None] + [MonteCarloAgent(arguments.rollouts) for _ in range(arguments.cpu)]
+        game = PonderingGamestate(len(agents), agents=agents, ponder=not arguments.no_ponder)
+    else:
+        game = gamestate.Gamestate()
     game.start_game()
+    with archive.GameArchive() as game_archive:
+        game_archive.add(game)
 
 
 if __name__ == '__main__':
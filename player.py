@@ -1,6 +1,10 @@
 from dataclasses import dataclass
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Player:
     name: str
+
+    def __hash__(self):
+        # Players are dictionary keys all over the `Gamestate`, so skip the tuple the generated `__hash__` builds
+        return hash(self.name)
@@ -0,0 +1,350 @@
+"""
+Pondering for CPU players. While a human player decides, a background thread plays rollouts for every
+`MonteCarloAgent` in the game, from a copy of the state at the start of the human's turn. Each rollout guesses the
+human's action, plays on until the CPU player's next turn and evaluates one of its options there.
+Statistics are kept per sequence of decisions the human took in the rollout. Once the human's turn is over, only the
+statistics of the actual decisions are handed to the CPU players, which start their search from them, so their next
+decision needs few or no rollouts of its own.
+
+Usage:
+    game = PonderingGamestate(3, agents=[None, MonteCarloAgent(), MonteCarloAgent()])
+    game.start_game()
+"""
+import argparse
+import builtins
+import itertools
+import random
+import threading
+import time
+from typing import Callable
+
+from agent import Agent
+from card import Card
+from effect import Effect
+from gamestate import Gamestate
+from heuristic_agent import HeuristicAgent
+from player import Player
+from search_agent import MonteCarloAgent, ScriptedAgent, Stats, effect_key, play_out, rollout_copy
+
+
+class _RecordingAgent(Agent):
+    """ Agent of the human player in a pondering rollout, which records the human's decisions of the pondered turn. """
+
+    def __init__(self, agent: Agent, turn: tuple[int, int]):
+        """
+        :param agent: Agent taking the decisions.
+        :param turn: Round and turn number of the pondered turn.
+        """
+        self.agent = agent
+        self.turn = turn
+        self.decisions: list[str] = []
+
+    def _record(self, gamestate: Gamestate, choice):
+        if (gamestate.round_number, gamestate.turn_number) == self.turn:
+            self.decisions.append(ScriptedAgent.key(choice))
+        return choice
+
+    def select_effect(self, gamestate: Gamestate, player: Player, effects: list[Effect]) -> Effect:
+        return self._record(gamestate, self.agent.select_effect(gamestate, player, effects))
+
+    def select_target(self, gamestate: Gamestate, player: Player, targets: list[Player]) -> Player:
+        return self._record(gamestate, self.agent.select_target(gamestate, player, targets))
+
+    def select_card(self, gamestate: Gamestate, player: Player, cards: list[Card]) -> Card:
+        return self._record(gamestate, self.agent.select_card(gamestate, player, cards))
+
+    def select_value(self, gamestate: Gamestate, player: Player, start: int, end: int) -> int:
+        return self._record(gamestate, self.agent.select_value(gamestate, player, start, end))
+
+
+class _CaptureAgent(Agent):
+    """
+    Agent of a CPU player in a pondering rollout. At the player's first effect selection, it plays the least explored
+    option of that decision and remembers it, so the outcome of the rollout can be added to its statistics.
+    """
+
+    def __init__(self, bot: MonteCarloAgent, table: Callable[[], dict[str, Stats]], policy: Agent,
+                 rng: random.Random):
+        """
+        :param bot: Agent of the CPU player, which defines the keys of its decisions.
+        :param table: Returns the statistics to add the rollout to. Called at the player's decision, once the
+            human's decisions of the pondered turn are known.
+        :param policy: Agent taking all other decisions.
+        :param rng: Random number generator to break ties with.
+        """
+        self.bot = bot
+        self.table = table
+        self.policy = policy
+        self.rng = rng
+        self.captured: tuple[Stats, str] | None = None
+
+    def select_effect(self, gamestate: Gamestate, player: Player, effects: list[Effect]) -> Effect:
+        if self.captured is not None or len(effects) < 2:
+            return self.policy.select_effect(gamestate, player, effects)
+        stats = self.table().setdefault(self.bot.decision_key(gamestate, player, effects), {})
+        effect = min(effects, key=lambda e: (stats.get(effect_key(e), (0, 0))[1], self.rng.random()))
+        self.captured = stats, effect_key(effect)
+        return effect
+
+    def select_target(self, gamestate: Gamestate, player: Player, targets: list[Player]) -> Player:
+        return self.policy.select_target(gamestate, player, targets)
+
+    def select_card(self, gamestate: Gamestate, player: Player, cards: list[Card]) -> Card:
+        return self.policy.select_card(gamestate, player, cards)
+
+    def select_value(self, gamestate: Gamestate, player: Player, start: int, end: int) -> int:
+        return self.policy.select_value(gamestate, player, start, end)
+
+
+class Ponderer:
+    """
+    Background search for the CPU players of a game. `start()` and `stop()` must be called from the thread running the
+    game, the statistics are only handed to the CPU players in `commit()`, after the background thread stopped.
+    The human may take several decisions in their turn, e.g. an effect and its target. Pondering is restarted for every
+    decision with the decisions taken so far, and only rollouts in which the human took these decisions are kept.
+    """
+
+    def __init__(self, bots: dict[Player, MonteCarloAgent], seed: int | None = None):
+        """
+        :param bots: CPU players to ponder for.
+        :param seed: Seed of the rollouts.
+        """
+        self.bots = bots
+        self.rng = random.Random(seed)
+        # The background thread must not share agents or random number generators with the game
+        self.policy = HeuristicAgent(seed=self.rng.getrandbits(32))
+        # Statistics by the human's decisions in the pondered turn, CPU player and decision key
+        self.tables: dict[tuple[str, ...], dict[Player, dict[str, Stats]]] = {}
+        self.rollouts = 0
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self, root: Gamestate, human: Player, script: list[str]) -> None:
+        """
+        Starts pondering in the background.
+
+        :param root: Copy of the game, taken while `human` selected the effect to play.
+        :param human: Human player who is deciding.
+        :param script: Decisions the human already took this turn. If empty, the human's action is guessed.
+        """
+        self.stop()
+        # Rollouts in which the human decided differently than they actually did are of no use anymore
+        self.tables = {decisions: table for decisions, table in self.tables.items()
+                       if list(decisions[:len(script)]) == script}
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(root, human, list(script)), daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """ Stops pondering after the current rollout. """
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def commit(self, decisions: list[str]) -> None:
+        """
+        Hands the statistics gathered for the human's actual decisions of their turn to the CPU players and discards
+        all others.
+        """
+        for player, table in self.tables.pop(tuple(decisions), {}).items():
+            pondered = self.bots[player].pondered
+            for key, stats in table.items():
+                merged = pondered.setdefault(key, {})
+                for option, (wins, visits) in stats.items():
+                    total = merged.setdefault(option, [0.0, 0])
+                    total[0] += wins
+                    total[1] += visits
+        self.tables = {}
+
+    def _run(self, root: Gamestate, human: Player, script: list[str]) -> None:
+        bots = [(player, bot) for player, bot in self.bots.items()
+                if player is not human and player not in root.players_out]
+        if len(bots) == 0:
+            return
+        for player, bot in itertools.cycle(bots):
+            if self._stop.is_set():
+                return
+            self._ponder_once(root, human, script, player, bot)
+
+    def _ponder_once(self, root: Gamestate, human: Player, script: list[str], player: Player,
+                     bot: MonteCarloAgent) -> None:
+        if len(script) > 0:
+            action = script[0]
+        else:
+            # Guess the human's card from the cards the CPU player can't see, weighted by their number
+            hidden = list(root.deck) + [card for other in root.players_in_game if other is not player
+                                        for card in root.hands[other]]
+            card = self.rng.choice(hidden)
+            effects = [effect for effect in (card.effect, card.effect_madness) if effect is not None]
+            action = effect_key(self.rng.choice(effects))
+        gamestate = rollout_copy(root, player, self.rng, self.policy, required=(human, action.split(":")[0]))
+        if gamestate is None:
+            return
+        card = next(card for card in gamestate.hands[human] if card.code == action.split(":")[0])
+        if not any(effect_key(effect) == action and effect.can_activate(gamestate, human)
+                   for effect in (card.effect, card.effect_madness) if effect is not None):
+            return
+        recorder = _RecordingAgent(ScriptedAgent([action] + script[1:], self.policy),
+                                   (root.round_number, root.turn_number))
+        capture = _CaptureAgent(bot, lambda: self.tables.setdefault(tuple(recorder.decisions), {}).setdefault(
+            player, {}), self.policy, self.rng)
+        gamestate.agents[human] = recorder
+        gamestate.agents[player] = capture
+        winner = play_out(gamestate, human)
+        self.rollouts += 1
+        if capture.captured is not None:
+            stats, option = capture.captured
+            total = stats.setdefault(option, [0.0, 0])
+            total[0] += 1.0 if winner == player else 0.0
+            total[1] += 1
+
+
+class PonderingGamestate(Gamestate):
+    """
+    Gamestate which lets its `MonteCarloAgent` players ponder while a human player decides during their own turn.
+    """
+
+    def __init__(self, *args, ponder: bool = True, **kwargs):
+        """
+        See `Gamestate`.
+
+        :param ponder: Whether CPU players ponder at all. Default is True.
+        """
+        super().__init__(*args, **kwargs)
+        bots = {player: agent for player, agent in self.agents.items() if isinstance(agent, MonteCarloAgent)}
+        self.ponderer = Ponderer(bots, self.rng.getrandbits(32)) if ponder and len(bots) > 0 else None
+        self._ponder_root: Gamestate | None = None
+        self._ponder_script: list[str] = []
+
+    def _human_turn(self, player: Player) -> bool:
+        return (self.ponderer is not None and player not in self.agents and player == self.turn_player
+                and self._ponder_root is not None
+                and (self._ponder_root.round_number, self._ponder_root.turn_number) == (self.round_number,
+                                                                                       self.turn_number))
+
+    def _ponder_while(self, player: Player, decide):
+        """ Ponders while `decide()` prompts the human, then keeps the statistics of the human's decision. """
+        self.ponderer.start(self._ponder_root, player, self._ponder_script)
+        try:
+            choice = decide()
+        finally:
+            self.ponderer.stop()
+        return choice
+
+    def _decided(self, choice) -> None:
+        self._ponder_script.append(ScriptedAgent.key(choice))
+
+    def process_turn(self) -> None:
+        try:
+            super().process_turn()
+        finally:
+            if self._ponder_root is not None:
+                # The human's turn is over, so all of their decisions are known
+                self.ponderer.commit(self._ponder_script)
+                self._ponder_root = None
+
+    def select_effect_from(self, cards_or_effects: Card | list[Card] | list[Effect], activating_player: Player,
+                           auto_return: bool = False, ignore_activation_condition: bool = False) -> Effect:
+        def decide():
+            return super(PonderingGamestate, self).select_effect_from(cards_or_effects, activating_player,
+                                                                      auto_return, ignore_activation_condition)
+
+        if self.ponderer is None or activating_player in self.agents or activating_player != self.turn_player:
+            return decide()
+        # The card to play is selected first, so this is the state all rollouts of this turn start from
+        self._ponder_root = self.clone()
+        self._ponder_script = []
+        effect = self._ponder_while(activating_player, decide)
+        self._decided(effect)
+        return effect
+
+    def select_target_player(self, activating_player: Player, allow_last_self_target: bool = False,
+                             deciding_player: Player = None, custom_target_filter=None,
+                             apply_default_target_filter: bool = True) -> Player | None:
+        def decide():
+            return super(PonderingGamestate, self).select_target_player(
+                activating_player, allow_last_self_target, deciding_player, custom_target_filter,
+                apply_default_target_filter)
+
+        player = deciding_player or activating_player
+        if not self._human_turn(player):
+            return decide()
+        target = self._ponder_while(player, decide)
+        # Without any valid target, nobody is asked and the activating player may be targeted automatically
+        if target is not None and target != activating_player:
+            self._decided(target)
+        return target
+
+    def select_card_from(self, cards: list[Card], deciding_player: Player | None = None) -> Card:
+        def decide():
+            return super(PonderingGamestate, self).select_card_from(cards, deciding_player)
+
+        player = deciding_player or self.turn_player
+        if len(cards) < 2 or not self._human_turn(player):
+            return decide()
+        card = self._ponder_while(player, decide)
+        self._decided(card)
+        return card
+
+    def select_card_value(self, deciding_player: Player, start=1, end=8) -> int:
+        def decide():
+            return super(PonderingGamestate, self).select_card_value(deciding_player, start, end)
+
+        if not self._human_turn(deciding_player):
+            return decide()
+        value = self._ponder_while(deciding_player, decide)
+        self._decided(value)
+        return value
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Decision time of CPU players with and without pondering, "
+                                                 "against a simulated human who thinks for a fixed time")
+    parser.add_argument("--games", type=int, default=3, help="Number of games per setting")
+    parser.add_argument("--players", type=int, default=3, help="Number of players, the first one is human")
+    parser.add_argument("--rollouts", type=int, default=32, help="Rollouts per option")
+    parser.add_argument("--think", type=float, default=1.0, help="Seconds the simulated human thinks per decision")
+    arguments = parser.parse_args()
+
+    # The simulated human answers every prompt with the options in order, which quickly finds a valid one
+    answers = itertools.cycle("123456789")
+
+    def simulated_input(prompt: str = "") -> str:
+        time.sleep(arguments.think)
+        return next(answers)
+
+    original_input = builtins.input
+    builtins.input = simulated_input
+    try:
+        for ponder in (False, True):
+            decision_times, rollouts_played, rollouts_reused = [], 0, 0
+            for seed in range(arguments.games):
+                bots = [MonteCarloAgent(arguments.rollouts, seed=seed * 16 + seat)
+                        for seat in range(1, arguments.players)]
+                for bot in bots:
+                    select_effect = bot.select_effect
+
+                    def timed(gamestate, player, effects, select_effect=select_effect):
+                        started = time.perf_counter()
+                        effect = select_effect(gamestate, player, effects)
+                        decision_times.append(time.perf_counter() - started)
+                        return effect
+
+                    bot.select_effect = timed
+                game = PonderingGamestate(arguments.players, agents=[None] + bots, seed=seed, headless=True,
+                                          ponder=ponder)
+                game.start_game()
+                rollouts_played += sum(bot.rollouts_played for bot in bots)
+                rollouts_reused += sum(bot.rollouts_reused for bot in bots)
+            decision_times.sort()
+            print(f"{'With' if ponder else 'Without'} pondering: median decision "
+                  f"{decision_times[len(decision_times) // 2] * 1e3:.0f} ms, "
+                  f"mean {sum(decision_times) / len(decision_times) * 1e3:.0f} ms over {len(decision_times)} "
+                  f"decisions, {rollouts_played} rollouts played on own turns, {rollouts_reused} reused from pondering")
+    finally:
+        builtins.input = original_input
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,531 @@
+"""
+Append-only experience store for self-play training. Every decision of a recorded player is stored as one fixed-size
+record (see `RECORD_DTYPE`) with the encoded observation, the mask of legal actions, the action taken and the
+outcome of the game.
+
+Records live in memory-mapped segment files, one per writer process, so simulations append without any locking.
+A writer publishes records by updating the record count in the segment header after the records are written, readers
+never look past that count. Next to every segment, an index file lists the records of every (game, round).
+Readers map the segments read-only and hand out NumPy views of them, so a trainer never deserializes anything.
+
+Usage:
+    python replay_buffer.py --directory replay --games 10000 --writers 8
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from agent import Agent
+from card import Card
+from compact import CARD_CODES, CARD_IDS
+from effect import Effect
+from player import Player
+from simulation import AgentFactory, heuristic_agents
+
+MAX_PLAYERS = 6
+NUM_CARDS = len(CARD_CODES)
+# Own hand, banished cards and per seat (relative to the observing player): discard pile, flags and scores
+OBSERVATION_SIZE = NUM_CARDS + NUM_CARDS + 1 + MAX_PLAYERS * (NUM_CARDS + 5)
+
+# Actions of all decision kinds share one action space: effects by card and madness, target seats relative to the
+# deciding player, cards to select and card values
+EFFECT_ACTIONS = 0
+TARGET_ACTIONS = EFFECT_ACTIONS + 2 * NUM_CARDS
+CARD_ACTIONS = TARGET_ACTIONS + MAX_PLAYERS
+VALUE_ACTIONS = CARD_ACTIONS + NUM_CARDS
+NUM_ACTIONS = VALUE_ACTIONS + 9
+DECISION_KINDS = {"effect": 0, "target": 1, "card": 2, "value": 3}
+
+RECORD_DTYPE = np.dtype([
+    ("game_id", "<u8"),
+    ("round", "<u2"),
+    ("turn", "<u2"),
+    ("seat", "u1"),
+    ("kind", "u1"),
+    ("action", "u1"),
+    # 1 if the deciding player won the game, -1 otherwise
+    ("outcome", "i1"),
+    ("observation", "u1", (OBSERVATION_SIZE,)),
+    ("mask", "?", (NUM_ACTIONS,)),
+])
+INDEX_DTYPE = np.dtype([("game_id", "<u8"), ("round", "<u2"), ("start", "<u8"), ("count", "<u4")])
+
+MAGIC = b"LLRB0001"
+HEADER_SIZE = 64
+# Game ids are unique across writers, the writer id is stored in the upper bits
+WRITER_ID_SHIFT = 40
+
+
+def encode_observation(gamestate: "Gamestate", player: Player) -> np.ndarray:
+    """
+    Encodes what `player` knows about the current state as a vector of small integers, see `OBSERVATION_SIZE`.
+    Seats are relative to `player`, i.e. the player's own seat comes first.
+    """
+    if len(gamestate.players) > MAX_PLAYERS:
+        raise ValueError(f"Observations support at most {MAX_PLAYERS} players")
+    observation = np.zeros(OBSERVATION_SIZE, dtype=np.uint8)
+    for card in gamestate.hands[player]:
+        observation[CARD_IDS[card.code]] += 1
+    offset = NUM_CARDS
+    for card in gamestate.banished_cards:
+        observation[offset + CARD_IDS[card.code]] += 1
+    observation[offset + NUM_CARDS] = len(gamestate.deck)
+    offset += NUM_CARDS + 1
+    seat = gamestate.players.index(player)
+    for other in gamestate.players[seat:] + gamestate.players[:seat]:
+        for card in gamestate.discard_pile[other]:
+            observation[offset + CARD_IDS[card.code]] += 1
+        observation[offset + NUM_CARDS:offset + NUM_CARDS + 5] = (
+            other in gamestate.players_out, other in gamestate.players_protected, other is gamestate.turn_player,
+            *gamestate.scores[other])
+        offset += NUM_CARDS + 5
+    return observation
+
+
+def effect_action(effect: Effect) -> int:
+    return EFFECT_ACTIONS + 2 * CARD_IDS[effect.card.code] + effect.is_madness
+
+
+def target_action(gamestate: "Gamestate", player: Player, target: Player) -> int:
+    return TARGET_ACTIONS + (gamestate.players.index(target) - gamestate.players.index(player)) % len(gamestate.players)
+
+
+class SegmentWriter:
+    """
+    Appends records to the segment of one writer. Only a single process may write to a segment, but any number of
+    processes may read it at the same time.
+    """
+
+    def __init__(self, directory: str, writer_id: int, grow_records: int = 1 << 16):
+        """
+        :param directory: Directory of the replay buffer. It is created if it doesn't exist.
+        :param writer_id: Id of the writer, unique among all writers of the directory.
+        :param grow_records: Number of records the segment file grows by when it is full.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.writer_id = writer_id
+        self.grow_records = grow_records
+        self.path = os.path.join(directory, f"segment-{writer_id:04d}.bin")
+        self.index_path = os.path.join(directory, f"segment-{writer_id:04d}.idx")
+        if not os.path.exists(self.path):
+            with open(self.path, "wb") as f:
+                f.write(MAGIC.ljust(HEADER_SIZE, b"\0"))
+        self.file = open(self.path, "r+b")
+        self.count = read_count(self.path)
+        self._truncate_index()
+        self.index_file = open(self.index_path, "ab")
+        self.capacity = 0
+        self.records = None
+        self._map(max(self.count, grow_records))
+        # Header with the number of published records, mapped separately so it can be updated with a single store
+        self.header = np.memmap(self.path, dtype="<u8", mode="r+", offset=len(MAGIC), shape=(1,))
+        self.next_game = 0 if self.count == 0 else int(self.records[self.count - 1]["game_id"]) + 1
+
+    def _truncate_index(self) -> None:
+        """
+        Drops index entries of records that were never published, e.g. because a previous writer crashed between
+        writing the index and publishing the count. Their game ids are given out again and their records overwritten.
+        """
+        if not os.path.exists(self.index_path):
+            return
+        entries = os.path.getsize(self.index_path) // INDEX_DTYPE.itemsize
+        index = np.fromfile(self.index_path, dtype=INDEX_DTYPE, count=entries)
+        # Entries cover consecutive records, so their ends are increasing
+        published = int(np.searchsorted(index["start"] + index["count"], self.count, side="right"))
+        with open(self.index_path, "r+b") as f:
+            f.truncate(published * INDEX_DTYPE.itemsize)
+
+    def _map(self, capacity: int) -> None:
+        self.file.truncate(HEADER_SIZE + capacity * RECORD_DTYPE.itemsize)
+        self.records = np.memmap(self.file, dtype=RECORD_DTYPE, mode="r+", offset=HEADER_SIZE, shape=(capacity,))
+        self.capacity = capacity
+
+    def new_game_id(self) -> int:
+        game_id = (self.writer_id << WRITER_ID_SHIFT) | (self.next_game & ((1 << WRITER_ID_SHIFT) - 1))
+        self.next_game += 1
+        return game_id
+
+    def append(self, records: np.ndarray) -> None:
+        """
+        Appends records and publishes them to readers. Records of the same (game, round) must be consecutive.
+
+        :param records: Array of `RECORD_DTYPE`.
+        """
+        if len(records) == 0:
+            return
+        if self.count + len(records) > self.capacity:
+            self.records.flush()
+            self._map(self.capacity + max(self.grow_records, len(records)))
+        start = self.count
+        self.records[start:start + len(records)] = records
+        game_ids, rounds = records["game_id"], records["round"]
+        boundaries = np.flatnonzero((game_ids[1:] != game_ids[:-1]) | (rounds[1:] != rounds[:-1])) + 1
+        starts = np.concatenate(([0], boundaries))
+        index = np.empty(len(starts), dtype=INDEX_DTYPE)
+        index["game_id"] = game_ids[starts]
+        index["round"] = rounds[starts]
+        index["start"] = start + starts
+        index["count"] = np.diff(np.concatenate((starts, [len(records)])))
+        self.index_file.write(index.tobytes())
+        self.index_file.flush()
+        self.count += len(records)
+        # Publish the records only after they have been written
+        self.header[0] = self.count
+
+    def close(self) -> None:
+        self.records.flush()
+        self.header.flush()
+        del self.records, self.header
+        self.file.close()
+        self.index_file.close()
+
+    def __enter__(self) -> "SegmentWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+
+def read_count(path: str) -> int:
+    """ :return: Number of published records of a segment. """
+    with open(path, "rb") as f:
+        header = f.read(HEADER_SIZE)
+    if header[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"{path} is not a replay buffer segment")
+    return int(np.frombuffer(header, dtype="<u8", count=1, offset=len(MAGIC))[0])
+
+
+class SumTree:
+    """
+    Binary tree over the sampling priorities of the records of one segment, kept in a memory-mapped file so it can
+    grow far beyond RAM. Every node holds the sum of its children, so updating priorities and sampling proportional to
+    them both cost O(log n) per record.
+    Nodes are stored in a flat array: the root is node 1, node i has the children 2i and 2i + 1, and the leaves start
+    at `capacity`, a power of two.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.size = 0
+        self.capacity = 0
+        self.tree = None
+        self._allocate(1)
+
+    def _allocate(self, capacity: int) -> None:
+        """ Moves the tree to a new file with room for `capacity` leaves and recomputes all inner nodes. """
+        tree = np.memmap(self.path + ".new", dtype=np.float64, mode="w+", shape=(2 * capacity,))
+        if self.tree is not None:
+            tree[capacity:capacity + self.size] = self.tree[self.capacity:self.capacity + self.size]
+        lower = capacity
+        while lower > 1:
+            # Sums of the children of all nodes of the level above `lower`
+            tree[lower // 2:lower] = tree[lower:2 * lower:2] + tree[lower + 1:2 * lower:2]
+            lower //= 2
+        os.replace(self.path + ".new", self.path)
+        self.tree, self.capacity = tree, capacity
+
+    def extend(self, count: int) -> None:
+        """ Adds `count` leaves with priority 1. """
+        if self.size + count > self.capacity:
+            self._allocate(1 << (self.size + count - 1).bit_length())
+        self.size += count
+        self.update(np.arange(self.size - count, self.size), np.ones(count))
+
+    @property
+    def total(self) -> float:
+        return float(self.tree[1])
+
+    def update(self, positions: np.ndarray, priorities: np.ndarray) -> None:
+        """ Sets the priorities of leaves and the sums of their ancestors. """
+        nodes = self.capacity + np.asarray(positions, dtype=np.int64)
+        self.tree[nodes] = priorities
+        nodes = np.unique(nodes // 2)
+        while len(nodes) > 0 and nodes[0] >= 1:
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+            nodes = np.unique(nodes[nodes > 1] // 2)
+
+    def find(self, values: np.ndarray) -> np.ndarray:
+        """ :return: Positions of the leaves whose priorities cover `values` in [0, total) in prefix sum order. """
+        nodes = np.ones(len(values), dtype=np.int64)
+        values = np.array(values, dtype=np.float64)
+        for _ in range(self.capacity.bit_length() - 1):
+            left = self.tree[2 * nodes]
+            right = values >= left
+            values -= np.where(right, left, 0.0)
+            nodes = 2 * nodes + right
+        # Rounding may end up in a leaf past the last one, which has priority 0
+        return np.minimum(nodes - self.capacity, self.size - 1)
+
+    def close(self) -> None:
+        del self.tree
+        self.tree = None
+
+
+class ReplayBuffer:
+    """
+    Read-only view of all segments of a directory. Call `refresh()` to see records appended since the buffer was
+    opened. Records are addressed by a global index over all segments, in the order of the segment files.
+    Sampling priorities are kept per segment in a `SumTree` file of the buffer's own, the segments are never written.
+    """
+
+    def __init__(self, directory: str, priority_directory: str | None = None):
+        """
+        :param directory: Directory of the replay buffer.
+        :param priority_directory: Directory for the sum tree files of the priorities. A temporary directory, which is
+            removed by `close()`, if None.
+        """
+        self.directory = directory
+        self._temporary = priority_directory is None
+        self.priority_directory = tempfile.mkdtemp(prefix="replay-priorities-") if self._temporary \
+            else priority_directory
+        os.makedirs(self.priority_directory, exist_ok=True)
+        # Paths of the segments, in the order of their global indices
+        self.paths: list[str] = []
+        self.segments: list[np.ndarray] = []
+        self.indexes: list[np.ndarray] = []
+        self.offsets = np.zeros(1, dtype=np.int64)
+        # Priorities by segment path, since new segments may sort before existing ones
+        self.priorities: dict[str, SumTree] = {}
+        self.refresh()
+
+    def refresh(self) -> None:
+        """ Maps all segments again, including new segments and new records of existing segments. """
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith(".bin"))
+        paths, segments, indexes = [], [], []
+        for name in names:
+            path = os.path.join(self.directory, name)
+            paths.append(path)
+            count = read_count(path)
+            segments.append(np.memmap(path, dtype=RECORD_DTYPE, mode="r", offset=HEADER_SIZE, shape=(count,))
+                            if count > 0 else np.empty(0, dtype=RECORD_DTYPE))
+            index = np.fromfile(path[:-len(".bin")] + ".idx", dtype=INDEX_DTYPE)
+            # The index may already list records which haven't been published when the count was read
+            indexes.append(index[index["start"] + index["count"] <= count])
+            if path not in self.priorities:
+                self.priorities[path] = SumTree(os.path.join(self.priority_directory, name[:-len(".bin")] + ".pri"))
+            if count > self.priorities[path].size:
+                self.priorities[path].extend(count - self.priorities[path].size)
+        self.paths, self.segments, self.indexes = paths, segments, indexes
+        self.offsets = np.concatenate(([0], np.cumsum([len(segment) for segment in segments]))).astype(np.int64)
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def _locate(self, indices: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        segment = np.searchsorted(self.offsets, indices, side="right") - 1
+        return segment, indices - self.offsets[segment]
+
+    def game_round(self, game_id: int, round_number: int) -> np.ndarray:
+        """ :return: View of all records of a round of a game, empty if there are none. """
+        for segment, index in zip(self.segments, self.indexes):
+            position = np.searchsorted(index["game_id"], game_id)
+            while position < len(index) and index["game_id"][position] == game_id:
+                if index["round"][position] == round_number:
+                    start, count = int(index["start"][position]), int(index["count"][position])
+                    return segment[start:start + count]
+                position += 1
+        return np.empty(0, dtype=RECORD_DTYPE)
+
+    def sample_indices(self, batch_size: int, rng: np.random.Generator, prioritized: bool = False) -> np.ndarray:
+        """
+        Samples global record indices with replacement, uniformly or proportional to the priorities of the records
+        (see `update_priorities`).
+        """
+        if len(self) == 0:
+            raise ValueError("Replay buffer is empty")
+        if not prioritized:
+            return rng.integers(0, len(self), size=batch_size)
+        trees = [self.priorities[path] for path in self.paths]
+        totals = np.array([tree.total if len(segment) > 0 else 0.0 for tree, segment in zip(trees, self.segments)])
+        segments = rng.choice(len(self.segments), size=batch_size, p=totals / totals.sum())
+        indices = np.empty(batch_size, dtype=np.int64)
+        for segment in np.unique(segments):
+            selected = segments == segment
+            tree = trees[segment]
+            indices[selected] = self.offsets[segment] + tree.find(rng.random(selected.sum()) * tree.total)
+        return indices
+
+    def update_priorities(self, indices: np.ndarray, priorities: np.ndarray) -> None:
+        """
+        Sets the sampling priorities of records by global index, in O(log n) per record. Priorities only live as long
+        as the buffer.
+        """
+        segments, positions = self._locate(np.asarray(indices))
+        for segment in np.unique(segments):
+            selected = segments == segment
+            self.priorities[self.paths[segment]].update(positions[selected], np.asarray(priorities)[selected])
+
+    def gather(self, indices: np.ndarray) -> np.ndarray:
+        """
+        :return: Records of the global indices. Scattered records can't be a view, so this is the only copy of the
+            batch and still doesn't deserialize anything.
+        """
+        segments, positions = self._locate(np.asarray(indices))
+        batch = np.empty(len(segments), dtype=RECORD_DTYPE)
+        for segment in np.unique(segments):
+            selected = segments == segment
+            batch[selected] = self.segments[segment][positions[selected]]
+        return batch
+
+    def sample(self, batch_size: int, rng: np.random.Generator, prioritized: bool = False) -> np.ndarray:
+        """ Samples records with replacement, see `sample_indices` and `gather`. """
+        return self.gather(self.sample_indices(batch_size, rng, prioritized))
+
+    def sample_windows(self, count: int, length: int, rng: np.random.Generator) -> list[np.ndarray]:
+        """
+        Samples consecutive runs of records, e.g. for sequence models, uniformly by start record.
+
+        :return: Zero-copy views of `count` runs of `length` records each. Runs don't cross segments.
+        """
+        eligible = np.array([max(len(segment) - length + 1, 0) for segment in self.segments])
+        if eligible.sum() == 0:
+            raise ValueError(f"No segment holds {length} records")
+        segments = rng.choice(len(self.segments), size=count, p=eligible / eligible.sum())
+        starts = (rng.random(count) * eligible[segments]).astype(np.int64)
+        return [self.segments[segment][start:start + length] for segment, start in zip(segments, starts)]
+
+    def close(self) -> None:
+        for tree in self.priorities.values():
+            tree.close()
+        self.priorities = {}
+        if self._temporary:
+            shutil.rmtree(self.priority_directory, ignore_errors=True)
+
+    def __enter__(self) -> "ReplayBuffer":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+
+class EpisodeRecorder:
+    """ Collects the decisions of a game and appends them to a segment once the outcome is known. """
+
+    def __init__(self, writer: SegmentWriter):
+        self.writer = writer
+        self.game_id = writer.new_game_id()
+        self.rows: list[tuple] = []
+
+    def record(self, gamestate: "Gamestate", player: Player, kind: str, mask: np.ndarray, action: int) -> None:
+        self.rows.append((self.game_id, gamestate.round_number, gamestate.turn_number,
+                          gamestate.players.index(player), DECISION_KINDS[kind], action, 0,
+                          encode_observation(gamestate, player), mask))
+
+    def finish(self, gamestate: "Gamestate") -> None:
+        """ Sets the outcome of all recorded decisions and appends them. """
+        records = np.array(self.rows, dtype=RECORD_DTYPE)
+        if gamestate.winner is not None and len(records) > 0:
+            winner = gamestate.players.index(gamestate.winner)
+            records["outcome"] = np.where(records["seat"] == winner, 1, -1)
+        # Rounds of a game are recorded in order, so records of the same (game, round) are consecutive already
+        self.writer.append(records)
+        self.rows = []
+
+
+class RecordingAgent(Agent):
+    """ Wraps an agent and records every decision it takes with an `EpisodeRecorder`. """
+
+    def __init__(self, agent: Agent, recorder: EpisodeRecorder):
+        self.agent = agent
+        self.recorder = recorder
+
+    def _record(self, gamestate: "Gamestate", player: Player, kind: str, legal: list[int], action: int) -> None:
+        mask = np.zeros(NUM_ACTIONS, dtype=bool)
+        mask[legal] = True
+        self.recorder.record(gamestate, player, kind, mask, action)
+
+    def select_effect(self, gamestate: "Gamestate", player: Player, effects: list[Effect]) -> Effect:
+        effect = self.agent.select_effect(gamestate, player, effects)
+        self._record(gamestate, player, "effect", [effect_action(e) for e in effects], effect_action(effect))
+        return effect
+
+    def select_target(self, gamestate: "Gamestate", player: Player, targets: list[Player]) -> Player:
+        target = self.agent.select_target(gamestate, player, targets)
+        self._record(gamestate, player, "target", [target_action(gamestate, player, t) for t in targets],
+                     target_action(gamestate, player, target))
+        return target
+
+    def select_card(self, gamestate: "Gamestate", player: Player, cards: list[Card]) -> Card:
+        card = self.agent.select_card(gamestate, player, cards)
+        self._record(gamestate, player, "card", [CARD_ACTIONS + CARD_IDS[c.code] for c in cards],
+                     CARD_ACTIONS + CARD_IDS[card.code])
+        return card
+
+    def select_value(self, gamestate: "Gamestate", player: Player, start: int, end: int) -> int:
+        value = self.agent.select_value(gamestate, player, start, end)
+        self._record(gamestate, player, "value", list(range(VALUE_ACTIONS + start, VALUE_ACTIONS + end + 1)),
+                     VALUE_ACTIONS + value)
+        return value
+
+
+def record_games(directory: str, writer_id: int, seeds: range, num_players: int = 3,
+                 agent_factory: AgentFactory = heuristic_agents) -> int:
+    """
+    Plays headless games and records the decisions of all players into the segment of `writer_id`.
+
+    :return: Number of records written.
+    """
+    from gamestate import Gamestate
+
+    with SegmentWriter(directory, writer_id) as writer:
+        before = writer.count
+        for seed in seeds:
+            recorder = EpisodeRecorder(writer)
+            game = Gamestate(num_players, seed=seed, headless=True,
+                             agents=[RecordingAgent(agent_factory(seed, seat), recorder)
+                                     for seat in range(num_players)])
+            game.start_game()
+            recorder.finish(game)
+        return writer.count - before
+
+
+def _record_games(arguments: tuple) -> int:
+    return record_games(*arguments)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record self-play decisions and sample them")
+    parser.add_argument("--directory", default="replay", help="Directory of the replay buffer")
+    parser.add_argument("--games", type=int, default=2000, help="Number of games to record")
+    parser.add_argument("--players", type=int, default=3, help="Number of players")
+    parser.add_argument("--writers", type=int, default=multiprocessing.cpu_count(), help="Number of writer processes")
+    parser.add_argument("--batch-size", type=int, default=4096, help="Records per sampled batch")
+    arguments = parser.parse_args()
+
+    started = time.perf_counter()
+    tasks = [(arguments.directory, writer_id, range(writer_id, arguments.games, arguments.writers), arguments.players)
+             for writer_id in range(arguments.writers)]
+    with multiprocessing.Pool(arguments.writers) as pool:
+        records = sum(pool.map(_record_games, tasks))
+    elapsed = time.perf_counter() - started
+    print(f"Recorded {records} decisions of {arguments.games} games in {elapsed:.1f}s "
+          f"({records / elapsed:.0f} records/s, {RECORD_DTYPE.itemsize} bytes each)")
+
+    with ReplayBuffer(arguments.directory) as buffer:
+        rng = np.random.default_rng(0)
+        for prioritized in (False, True):
+            started = time.perf_counter()
+            for _ in range(100):
+                batch = buffer.sample(arguments.batch_size, rng, prioritized)
+            per_batch = (time.perf_counter() - started) / 100
+            print(f"{'Prioritized' if prioritized else 'Uniform'} sampling from {len(buffer)} records: "
+                  f"{per_batch * 1e3:.2f} ms per batch of {len(batch)}")
+        started = time.perf_counter()
+        for _ in range(100):
+            indices = buffer.sample_indices(arguments.batch_size, rng, prioritized=True)
+            buffer.update_priorities(indices, rng.random(len(indices)) + 0.01)
+        print(f"Priority updates: {(time.perf_counter() - started) / 100 * 1e3:.2f} ms per batch")
+        first = buffer.segments[0][0]
+        round_records = buffer.game_round(int(first["game_id"]), int(first["round"]))
+        windows = buffer.sample_windows(4, 64, rng)
+        print(f"Round 1 of the first game: {len(round_records)} records, windows of {len(windows[0])} records, "
+              f"zero-copy: {np.shares_memory(round_records, buffer.segments[0])}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,256 @@
+"""
+Scenarios describe a position in the middle of a round declaratively, so a `Gamestate` can be built directly in that
+position instead of playing games until it happens. Scenarios are plain dicts or JSON files:
+
+    {
+        "players": ["Alice", "Bob", "Carol", "Dave", "Eve"],
+        "deck": "deck.txt",
+        "draw_pile": ["3", "1"],
+        "fill_draw_pile": true,
+        "hands": {"Alice": ["6m"], "Bob": ["5"], "Carol": ["2"], "Dave": ["4"], "Eve": ["1"]},
+        "discards": {"Bob": ["1m"]},
+        "protected": ["Dave"],
+        "turn_start": {"Dave": ["unprotect"]},
+        "turn_player": "Alice"
+    }
+
+Players are referenced by name or seat index. `hands`, `discards` and `scores` are dicts by player or lists with one
+entry per seat. The first card of `draw_pile` is drawn first. With `fill_draw_pile`, all cards of the deck which
+aren't placed anywhere are shuffled and put below `draw_pile`, otherwise every card of the deck has to be placed
+somewhere.
+
+Usage:
+    python scenario.py scenarios/card6_madness_5_players.json --turns 1
+    python scenario.py scenarios/insanity_chain.json --benchmark 10000
+"""
+import argparse
+import json
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from functools import partial
+
+from card import Card, CARD_NAMES, CREATED_CARD_CODES
+from console import quiet
+from game_end import GameOverException, RoundEndException
+from gamestate import Gamestate, load_deck
+from simulation import heuristic_agents
+
+SPEC_KEYS = frozenset({"players", "deck", "draw_pile", "fill_draw_pile", "hands", "discards", "banished",
+                       "protected", "out", "turn_start", "turn_player", "scores", "round_number", "turn_number",
+                       "seed"})
+
+# Functions which can be scheduled at the start of a player's turn, by name
+TURN_START_HOOKS = {
+    "unprotect": lambda player: partial(Gamestate.unprotect_player, player=player),
+}
+
+
+@dataclass
+class Scenario:
+    """
+    Validated scenario, which builds any number of gamestates in its position. Players are stored by seat index and
+    cards by code, so building a gamestate doesn't have to parse or validate anything.
+    """
+    player_names: list[str]
+    deck_composition: dict[str, int]
+    # Top of the draw pile first
+    draw_pile: list[str]
+    # Cards of the deck which aren't placed anywhere and are shuffled below `draw_pile` for every gamestate
+    fill: list[str]
+    hands: list[list[str]]
+    discards: list[list[str]]
+    banished: list[str] = field(default_factory=list)
+    protected: set[int] = field(default_factory=set)
+    out: set[int] = field(default_factory=set)
+    turn_start: dict[int, list[str]] = field(default_factory=dict)
+    turn_player: int = 0
+    scores: list[tuple[int, int]] = field(default_factory=list)
+    round_number: int = 1
+    turn_number: int = 0
+    seed: int | None = None
+
+    @classmethod
+    def from_spec(cls, spec: dict) -> "Scenario":
+        """
+        Parses and validates a scenario spec, see the module documentation.
+
+        :raises ValueError: If the spec is invalid, e.g. if cards are missing or placed more often than they
+            are in the deck.
+        """
+        unknown_keys = set(spec) - SPEC_KEYS
+        if len(unknown_keys) > 0:
+            raise ValueError(f"Unknown scenario key(s): {', '.join(sorted(unknown_keys))}")
+        players = spec.get("players", 2)
+        player_names = [f"Player {i + 1}" for i in range(players)] if isinstance(players, int) else list(players)
+        if len(player_names) < 2 or len(set(player_names)) != len(player_names):
+            raise ValueError("A scenario needs at least two players with distinct names")
+
+        def seat(reference: str | int) -> int:
+            if reference in player_names:
+                return player_names.index(reference)
+            # Keys of JSON objects are always strings, so seat indices may be given as strings as well
+            if isinstance(reference, str) and reference.isdigit():
+                reference = int(reference)
+            if isinstance(reference, int) and 0 <= reference < len(player_names):
+                return reference
+            raise ValueError(f"Unknown player {reference!r}")
+
+        def cards(codes: list[str]) -> list[str]:
+            for code in codes:
+                if code not in CARD_NAMES:
+                    raise ValueError(f"Unknown card code {code!r}")
+            return list(codes)
+
+        def per_seat(key: str, convert=cards, default=()) -> list:
+            """ Reads a field given either as a list with one entry per seat or as a dict by player. """
+            value = spec.get(key, {})
+            if isinstance(value, list):
+                if len(value) != len(player_names):
+                    raise ValueError(f"{key} must contain one entry per player")
+                return [convert(entry) for entry in value]
+            if not isinstance(value, dict):
+                raise ValueError(f"{key} must be a list with one entry per player or a dict by player")
+            result = [convert(default) for _ in player_names]
+            for reference, entry in value.items():
+                result[seat(reference)] = convert(entry)
+            return result
+
+        deck = spec.get("deck", "deck.txt")
+        scenario = cls(player_names=player_names,
+                       deck_composition=load_deck(deck) if isinstance(deck, str) else dict(deck),
+                       draw_pile=cards(spec.get("draw_pile", [])),
+                       fill=[],
+                       hands=per_seat("hands"),
+                       discards=per_seat("discards"),
+                       banished=cards(spec.get("banished", [])),
+                       protected={seat(reference) for reference in spec.get("protected", [])},
+                       out={seat(reference) for reference in spec.get("out", [])},
+                       turn_start={seat(reference): list(hooks) for reference, hooks
+                                   in spec.get("turn_start", {}).items()},
+                       turn_player=seat(spec.get("turn_player", 0)),
+                       round_number=spec.get("round_number", 1),
+                       turn_number=spec.get("turn_number", 0),
+                       scores=per_seat("scores", tuple, (0, 0)),
+                       seed=spec.get("seed"))
+        scenario._validate(spec.get("fill_draw_pile", False))
+        return scenario
+
+    @classmethod
+    def load(cls, path: str) -> "Scenario":
+        """ Reads a scenario spec from a JSON file. """
+        with open(path) as f:
+            return cls.from_spec(json.load(f))
+
+    def _validate(self, fill_draw_pile: bool) -> None:
+        placed = Counter(self.draw_pile) + Counter(self.banished)
+        for codes in self.hands + self.discards:
+            placed.update(codes)
+        deck = Counter({code: n for code, n in self.deck_composition.items() if n > 0})
+        too_many = {code: n - deck[code] for code, n in placed.items()
+                    if n > deck[code] and code not in CREATED_CARD_CODES}
+        if len(too_many) > 0:
+            raise ValueError(f"Cards placed more often than they are in the deck: {too_many}")
+        missing = deck - placed
+        if fill_draw_pile:
+            self.fill = sorted(missing.elements())
+        elif len(missing) > 0:
+            raise ValueError(f"Cards of the deck not placed anywhere: {dict(missing)} (use fill_draw_pile)")
+
+        for i, name in enumerate(self.player_names):
+            if i in self.out and len(self.hands[i]) > 0:
+                raise ValueError(f"{name} is out of the round, but holds cards")
+            if i not in self.out and len(self.hands[i]) == 0:
+                raise ValueError(f"{name} is in the round, but holds no cards")
+            if i in self.out and i in self.protected:
+                raise ValueError(f"{name} is out of the round, but protected")
+        if self.turn_player in self.out:
+            raise ValueError("The turn player is out of the round")
+        for i, hooks in self.turn_start.items():
+            for hook in hooks:
+                if hook not in TURN_START_HOOKS:
+                    raise ValueError(f"Unknown turn start hook {hook!r}, expected one of {', '.join(TURN_START_HOOKS)}")
+                if hook == "unprotect" and i not in self.protected:
+                    raise ValueError(f"{self.player_names[i]} is scheduled to be unprotected, but isn't protected")
+        if any(len(score) != 2 or min(score) < 0 for score in self.scores):
+            raise ValueError("Scores must be pairs of non-negative sanity and madness points")
+
+    def build(self, agents: list | None = None, seed: int | None = None, headless: bool = True) -> Gamestate:
+        """
+        Creates a gamestate in the position of this scenario. The round is ready to be continued with
+        `process_turn()` or `start_game(resume_round=True)`.
+
+        :param agents: Agents of the players, see `Gamestate`.
+        :param seed: Seed of the gamestate, which shuffles the filled cards of the draw pile and all decks of later
+            rounds. Default is the seed of the scenario.
+        :param headless: See `Gamestate`.
+        :return: New gamestate.
+        """
+        gamestate = Gamestate(self.player_names, deck=self.deck_composition, agents=agents,
+                              seed=seed if seed is not None else self.seed, headless=headless)
+        players = gamestate.players
+        fill = [Card.by_code(code) for code in self.fill]
+        gamestate.rng.shuffle(fill)
+        # Cards are drawn from the end of the deck
+        gamestate.deck = fill + [Card.by_code(code) for code in reversed(self.draw_pile)]
+        gamestate.banished_cards = [Card.by_code(code) for code in self.banished]
+        gamestate.hands = {player: [Card.by_code(code) for code in codes] for player, codes in zip(players, self.hands)}
+        gamestate.discard_pile = {player: [Card.by_code(code) for code in codes]
+                                  for player, codes in zip(players, self.discards)}
+        gamestate.players_out = {players[i] for i in self.out}
+        gamestate.players_protected = {players[i] for i in self.protected}
+        gamestate.on_player_turn_start = defaultdict(list)
+        for i, hooks in self.turn_start.items():
+            for hook in hooks:
+                gamestate.schedule_on_player_turn_start(players[i], TURN_START_HOOKS[hook](players[i]))
+        gamestate.turn_player = players[self.turn_player]
+        gamestate.scores = {player: score for player, score in zip(players, self.scores)}
+        gamestate.round_number = self.round_number
+        gamestate.turn_number = self.turn_number
+        return gamestate
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play turns from a scenario or benchmark building it")
+    parser.add_argument("scenario", help="JSON file of the scenario")
+    parser.add_argument("--turns", type=int, default=1, help="Number of turns to play with heuristic agents")
+    parser.add_argument("--seed", type=int, default=None, help="Seed of the gamestate and the agents")
+    parser.add_argument("--benchmark", type=int, default=0,
+                        help="Instead of playing, measure building the gamestate and playing its first turn")
+    arguments = parser.parse_args()
+
+    scenario = Scenario.load(arguments.scenario)
+    seed = arguments.seed if arguments.seed is not None else scenario.seed or 0
+    agents = [heuristic_agents(seed, seat) for seat in range(len(scenario.player_names))]
+    if arguments.benchmark > 0:
+        started = time.perf_counter()
+        for _ in range(arguments.benchmark):
+            scenario.build(agents, seed)
+        built = time.perf_counter()
+        with quiet():
+            for _ in range(arguments.benchmark):
+                gamestate = scenario.build(agents, seed)
+                try:
+                    gamestate.process_turn()
+                except (RoundEndException, GameOverException):
+                    pass
+        played = time.perf_counter()
+        print(f"Build: {(built - started) / arguments.benchmark * 1e6:.1f} µs, "
+              f"build and first turn: {(played - built) / arguments.benchmark * 1e6:.1f} µs")
+        return
+
+    # Headless gamestates only print anything within `start_game()`, so the turns are printed without pauses
+    gamestate = scenario.build(agents, seed)
+    gamestate.print_state(gamestate.turn_player)
+    try:
+        for _ in range(arguments.turns):
+            gamestate.process_turn()
+    except (RoundEndException, GameOverException) as e:
+        print(e)
+    print()
+    for event in gamestate.events:
+        print(event)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+"""
+Monte Carlo search agent. Every decision of the agent's own turn is evaluated by playing the rest of the round many
+times from copies of the current state, with the hidden cards shuffled anew for every copy (determinization).
+The option which wins the most of these rollouts is played. The rollouts themselves are played by heuristic agents.
+"""
+import random
+from typing import Any
+
+from agent import Agent
+from card import Card
+from console import quiet
+from decision_cache import information_set
+from effect import Effect
+from game_end import GameOverException, RoundEndException
+from heuristic_agent import HeuristicAgent, HeuristicParams
+from player import Player
+
+# Number of rollout wins and number of rollouts per option
+Stats = dict[str, list[float]]
+
+
+def effect_key(effect: Effect) -> str:
+    """ :return: Public description of playing an effect, which is the same in every copy of a game. """
+    return f"{effect.card.code}:{effect.effect.__name__}"
+
+
+def determinize(gamestate: "Gamestate", player: Player, rng: random.Random,
+                required: tuple[Player, str] | None = None) -> bool:
+    """
+    Shuffles all cards `player` can't see, i.e. the deck and the hands of all other players, and deals them again.
+    Hand sizes stay the same.
+
+    :param gamestate: Copy of a gamestate, which is modified in place.
+    :param player: Player whose knowledge is kept.
+    :param rng: Random number generator to shuffle with.
+    :param required: Player and card code that player must hold afterwards, e.g. because they are about to play it.
+    :return: False if the required card isn't among the hidden cards, in which case nothing is changed.
+    """
+    others = [other for other in gamestate.players if other is not player and other not in gamestate.players_out]
+    pool = list(gamestate.deck)
+    for other in others:
+        pool.extend(gamestate.hands[other])
+    rng.shuffle(pool)
+    if required is not None:
+        required_player, code = required
+        position = next((i for i, card in enumerate(pool) if card.code == code), None)
+        if position is None or required_player not in others:
+            return False
+        # Deal the required card first, the order of the required player's hand doesn't matter
+        others.remove(required_player)
+        others.insert(0, required_player)
+        pool[0], pool[position] = pool[position], pool[0]
+    for other in others:
+        n = len(gamestate.hands[other])
+        gamestate.hands[other], pool = pool[:n], pool[n:]
+    gamestate.deck = pool
+    return True
+
+
+class ScriptedAgent(Agent):
+    """
+    Agent which repeats a script of decisions, given by their public keys (see `ScriptedAgent.key`), and decides
+    with a fallback agent once the script is used up or doesn't fit the current options.
+    """
+
+    def __init__(self, script: list[str], fallback: Agent):
+        self.script = script
+        self.position = 0
+        self.fallback = fallback
+
+    @staticmethod
+    def key(option: Any) -> str:
+        if isinstance(option, Effect):
+            return effect_key(option)
+        if isinstance(option, Player):
+            return option.name
+        if isinstance(option, Card):
+            return option.code
+        return str(option)
+
+    def _scripted(self, options: list) -> Any | None:
+        if self.position >= len(self.script):
+            return None
+        key = self.script[self.position]
+        self.position += 1
+        return next((option for option in options if self.key(option) == key), None)
+
+    def select_effect(self, gamestate: "Gamestate", player: Player, effects: list[Effect]) -> Effect:
+        return self._scripted(effects) or self.fallback.select_effect(gamestate, player, effects)
+
+    def select_target(self, gamestate: "Gamestate", player: Player, targets: list[Player]) -> Player:
+        return self._scripted(targets) or self.fallback.select_target(gamestate, player, targets)
+
+    def select_card(self, gamestate: "Gamestate", player: Player, cards: list[Card]) -> Card:
+        return self._scripted(cards) or self.fallback.select_card(gamestate, player, cards)
+
+    def select_value(self, gamestate: "Gamestate", player: Player, start: int, end: int) -> int:
+        value = self._scripted(list(range(start, end + 1)))
+        return value if value is not None else self.fallback.select_value(gamestate, player, start, end)
+
+
+def play_out(gamestate: "Gamestate", player: Player) -> Player | None:
+    """
+    Continues a copy of a game, which was taken while `player` was selecting the effect to play, until the round
+    ends. The copy must have agents for all players.
+
+    :return: Winner of the round or None, if the round is a draw.
+    """
+    with quiet():
+        try:
+            gamestate.play_card_effect(player)
+            gamestate.turn_player = gamestate.next_player()
+            while True:
+                gamestate.process_turn()
+        except (RoundEndException, GameOverException) as e:
+            return e.winner
+
+
+def rollout_copy(root: "Gamestate", player: Player, rng: random.Random, policy: Agent,
+                 required: tuple[Player, str] | None = None) -> "Gamestate | None":
+    """
+    Copies a game for a rollout from the perspective of `player`, see `determinize`. All players are played by
+    `policy` and the copy never pauses or runs any hooks of the original game.
+    """
+    gamestate = root.clone()
+    if not determinize(gamestate, player, rng, required):
+        return None
+    gamestate.headless = True
+    gamestate.after_turn_hooks = []
+    gamestate.agents = {other: policy for other in gamestate.players}
+    return gamestate
+
+
+class MonteCarloAgent(Agent):
+    """
+    Agent which evaluates the options of every decision during its own turn with `rollouts` rollouts per option.
+    Decisions outside of its own turn are taken by a `HeuristicAgent`.
+
+    Rollouts start from a copy of the state at the beginning of the turn, taken when the card to play is selected.
+    Later decisions of the same turn (targets, values, cards) replay the decisions taken so far in every rollout.
+    """
+
+    def __init__(self, rollouts: int = 32, params: HeuristicParams | None = None, seed: int | None = None):
+        """
+        :param rollouts: Number of rollouts per option.
+        :param params: Parameters of the heuristic agents playing the rollouts and the decisions outside of the
+            agent's own turn.
+        :param seed: Seed of the rollouts.
+        """
+        self.rollouts = rollouts
+        self.rng = random.Random(seed)
+        self.policy = HeuristicAgent(params, seed=self.rng.getrandbits(32))
+        # Statistics of the first decision of upcoming turns by information set, gathered while pondering
+        self.pondered: dict[str, Stats] = {}
+        self.rollouts_played = 0
+        self.rollouts_reused = 0
+        self._root: "Gamestate | None" = None
+        self._script: list[str] = []
+
+    def decision_key(self, gamestate: "Gamestate", player: Player, options: list) -> str:
+        """ :return: Key of a decision by the information set of `player` and the options. """
+        return f"{information_set(gamestate, player)}|{','.join(sorted(map(ScriptedAgent.key, options)))}"
+
+    def rollout(self, root: "Gamestate", player: Player, script: list[str]) -> float:
+        """ :return: 1 if `player` wins the round after the scripted decisions, 0 otherwise. """
+        gamestate = rollout_copy(root, player, self.rng, self.policy)
+        gamestate.agents[player] = ScriptedAgent(script, self.policy)
+        self.rollouts_played += 1
+        return 1.0 if play_out(gamestate, player) == player else 0.0
+
+    def _in_own_turn(self, gamestate: "Gamestate", player: Player) -> bool:
+        return (self._root is not None and gamestate.turn_player == player
+                and (self._root.round_number, self._root.turn_number) == (gamestate.round_number,
+                                                                         gamestate.turn_number))
+
+    def _search(self, player: Player, options: list, stats: Stats | None = None) -> Any:
+        """ Plays the missing rollouts of every option and returns the option with the highest win rate. """
+        stats = stats if stats is not None else {}
+        keys = [ScriptedAgent.key(option) for option in options]
+        # Identical cards in hand give several options with the same key
+        for key in dict.fromkeys(keys):
+            wins, visits = stats.get(key, (0.0, 0))
+            self.rollouts_reused += visits
+            for _ in range(self.rollouts - visits):
+                wins += self.rollout(self._root, player, self._script + [key])
+                visits += 1
+            stats[key] = [wins, visits]
+        best = max(range(len(options)), key=lambda i: stats[keys[i]][0] / max(stats[keys[i]][1], 1))
+        return options[best]
+
+    def _decide(self, gamestate: "Gamestate", player: Player, options: list, fallback) -> Any:
+        if not self._in_own_turn(gamestate, player):
+            return fallback()
+        option = self._search(player, options) if len(options) > 1 else options[0]
+        self._script.append(ScriptedAgent.key(option))
+        return option
+
+    def select_effect(self, gamestate: "Gamestate", player: Player, effects: list[Effect]) -> Effect:
+        # The card to play is selected first, so this is the state all rollouts of this turn start from
+        self._root = gamestate.clone()
+        self._script = []
+        pondered = self.pondered.get(self.decision_key(gamestate, player, effects))
+        self.pondered = {}
+        effect = self._search(player, effects, pondered) if len(effects) > 1 else effects[0]
+        self._script.append(effect_key(effect))
+        return effect
+
+    def select_target(self, gamestate: "Gamestate", player: Player, targets: list[Player]) -> Player:
+        return self._decide(gamestate, player, targets,
+                            lambda: self.policy.select_target(gamestate, player, targets))
+
+    def select_card(self, gamestate: "Gamestate", player: Player, cards: list[Card]) -> Card:
+        return self._decide(gamestate, player, cards, lambda: self.policy.select_card(gamestate, player, cards))
+
+    def select_value(self, gamestate: "Gamestate", player: Player, start: int, end: int) -> int:
+        return self._decide(gamestate, player, list(range(start, end + 1)),
+                            lambda: self.policy.select_value(gamestate, player, start, end))
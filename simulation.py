@@ -0,0 +1,159 @@
+import argparse
+import importlib
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Callable, Iterable
+
+from agent import Agent, RandomAgent
+from gamestate import Gamestate
+from heuristic_agent import HeuristicAgent
+
+# Creates the agent for a seat, given the seed of the game and the seat index
+AgentFactory = Callable[[int, int], Agent]
+# Creates a headless game, given the number of players, the deck, the agents per seat and the seed
+Engine = Callable[[int, str | dict[str, int], list, int], Gamestate]
+
+
+def reference_engine(num_players: int, deck: str | dict[str, int], agents: list, seed: int) -> Gamestate:
+    """ The rules as implemented in `gamestate.py` and `effect.py`. """
+    return Gamestate(num_players, deck=deck, agents=agents, seed=seed, headless=True)
+
+
+def resolve_engine(name: str) -> Engine:
+    """ :return: The reference engine for "reference", otherwise the callable `name` refers to as `module:callable`. """
+    if name == "reference":
+        return reference_engine
+    module_name, _, attribute = name.partition(":")
+    if attribute == "":
+        raise ValueError(f"Unknown engine {name!r}, expected reference or module:callable")
+    return getattr(importlib.import_module(module_name), attribute)
+
+
+def heuristic_agents(seed: int, seat: int) -> Agent:
+    """ Default `AgentFactory`, which seeds every agent from the game seed, so games are reproducible. """
+    return HeuristicAgent(seed=seed * 16 + seat)
+
+
+def random_agents(seed: int, seat: int) -> Agent:
+    """ `AgentFactory` for agents without any strategy. """
+    return RandomAgent(seed * 16 + seat)
+
+
+@dataclass
+class SimulationStats:
+    """
+    Aggregated outcome of a number of games. Stats of different batches can be merged with `+`, which is how results
+    of parallel or distributed simulations are combined.
+    """
+    games: int = 0
+    rounds: int = 0
+    turns: int = 0
+    draws: int = 0
+    mad_round_wins: int = 0
+    seat_wins: list[int] = field(default_factory=list)
+    round_win_types: Counter = field(default_factory=Counter)
+    game_win_types: Counter = field(default_factory=Counter)
+
+    def add_game(self, gamestate: Gamestate) -> None:
+        """ Adds the outcome of a finished game, based on its event log. """
+        self.games += 1
+        if len(self.seat_wins) < len(gamestate.players):
+            self.seat_wins.extend([0] * (len(gamestate.players) - len(self.seat_wins)))
+        mad_players = set()
+        for event in gamestate.events:
+            if event.kind == "mad":
+                mad_players.add(event.player)
+            elif event.kind == "round_end":
+                self.rounds += 1
+                self.turns += event.turn_number
+                self.round_win_types[event.detail] += 1
+                if event.player < 0:
+                    self.draws += 1
+                elif event.player in mad_players:
+                    self.mad_round_wins += 1
+                mad_players = set()
+            elif event.kind == "game_end":
+                self.seat_wins[event.player] += 1
+                self.game_win_types[event.detail] += 1
+
+    def __add__(self, other: "SimulationStats") -> "SimulationStats":
+        seat_wins = [0] * max(len(self.seat_wins), len(other.seat_wins))
+        for wins in (self.seat_wins, other.seat_wins):
+            for seat, n in enumerate(wins):
+                seat_wins[seat] += n
+        return SimulationStats(games=self.games + other.games,
+                               rounds=self.rounds + other.rounds,
+                               turns=self.turns + other.turns,
+                               draws=self.draws + other.draws,
+                               mad_round_wins=self.mad_round_wins + other.mad_round_wins,
+                               seat_wins=seat_wins,
+                               round_win_types=self.round_win_types + other.round_win_types,
+                               game_win_types=self.game_win_types + other.game_win_types)
+
+    def to_dict(self) -> dict:
+        """ Converts the stats into plain JSON-serializable types. """
+        return {"games": self.games, "rounds": self.rounds, "turns": self.turns, "draws": self.draws,
+                "mad_round_wins": self.mad_round_wins, "seat_wins": list(self.seat_wins),
+                "round_win_types": dict(self.round_win_types), "game_win_types": dict(self.game_win_types)}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "SimulationStats":
+        return cls(games=data["games"], rounds=data["rounds"], turns=data["turns"], draws=data["draws"],
+                   mad_round_wins=data["mad_round_wins"], seat_wins=list(data["seat_wins"]),
+                   round_win_types=Counter(data["round_win_types"]), game_win_types=Counter(data["game_win_types"]))
+
+
+def play_game(seed: int, num_players: int, deck: str | dict[str, int] = "deck.txt",
+              agent_factory: AgentFactory = heuristic_agents, engine: Engine = reference_engine) -> Gamestate:
+    """
+    Plays a single headless game between CPU players.
+
+    :param seed: Seed of the game. It is also passed to `agent_factory`, so agents can be seeded from it.
+    :param num_players: Number of players.
+    :param deck: Deck file or deck composition, see `Gamestate`.
+    :param agent_factory: Creates the agent for every seat.
+    :param engine: Creates the game. Default are the reference rules.
+    :return: Gamestate of the finished game.
+    """
+    game = engine(num_players, deck, [agent_factory(seed, seat) for seat in range(num_players)], seed)
+    game.start_game()
+    return game
+
+
+def simulate(seeds: Iterable[int], num_players: int, deck: str | dict[str, int] = "deck.txt",
+             agent_factory: AgentFactory = heuristic_agents) -> SimulationStats:
+    """
+    Plays one headless game per seed and aggregates the outcomes.
+
+    :param seeds: Seeds of the games to play.
+    :param num_players: Number of players.
+    :param deck: Deck file or deck composition, see `Gamestate`.
+    :param agent_factory: Creates the agent for every seat.
+    :return: Aggregated stats of all games.
+    """
+    stats = SimulationStats()
+    for seed in seeds:
+        stats.add_game(play_game(seed, num_players, deck, agent_factory))
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput benchmark with headless games between CPU players")
+    parser.add_argument("--games", type=int, default=1000, help="Number of games")
+    parser.add_argument("--players", type=int, default=3, help="Number of players")
+    parser.add_argument("--deck", default="deck.txt", help="Deck file")
+    parser.add_argument("--random", action="store_true", help="Use random agents instead of heuristic agents")
+    arguments = parser.parse_args()
+
+    started = time.perf_counter()
+    stats = simulate(range(arguments.games), arguments.players, arguments.deck,
+                     random_agents if arguments.random else heuristic_agents)
+    elapsed = time.perf_counter() - started
+    print(f"{stats.games} games, {stats.rounds} rounds, {stats.turns} turns in {elapsed:.2f}s "
+          f"({stats.games / elapsed:.0f} games/s, {stats.turns / elapsed:.0f} turns/s)")
+    print(f"Win rate per seat: {', '.join(f'{wins / stats.games:.3f}' for wins in stats.seat_wins)}")
+
+
+if __name__ == '__main__':
+    main()